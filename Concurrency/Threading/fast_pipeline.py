@@ -0,0 +1,254 @@
+'''
+High-throughput versions of Pipeline from producer_consumer_using_events.py
+
+BatchPipeline   - bounded deque + two Conditions. put_many/get_many move a
+                  whole batch per lock acquisition and notification, and the
+                  debug logging is only formatted when DEBUG is enabled.
+SPSCRingBuffer  - one producer thread, one consumer thread, no lock at all.
+                  The producer only writes `tail`, the consumer only writes
+                  `head`, and each slot is filled before `tail` moves past it.
+                  This relies on the GIL keeping those writes in program order:
+                  only one thread runs bytecode at a time, so the consumer
+                  can never see the new `tail` before the slot writes. That
+                  does not hold on free-threaded builds (3.13t with the GIL
+                  disabled), where another thread may see the writes in a
+                  different order; use BatchPipeline there.
+                  get_many() sets the slots it read back to None, so the
+                  buffer does not keep consumed messages alive.
+
+BatchPipeline also has a shutdown lifecycle (see graceful_shutdown.py):
+close() refuses new messages and wakes every blocked thread, producers get
+PipelineClosed, consumers get an empty batch (get_message: CLOSED) once the
+pipeline is closed and empty, shutdown(timeout) closes, drains and drops
+whatever is still queued when the timeout runs out.
+'''
+
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = object()    # get_message() result once the pipeline is closed and empty
+
+
+class PipelineClosed(Exception):
+    pass
+
+
+class BatchPipeline:
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._all_done = threading.Condition(self._lock)
+        self._closed = False
+        self._unfinished = 0
+        self.put_count = 0
+        self.processed = 0
+        self.dropped = 0
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def put_many(self, items, name="Producer"):
+        '''Blocks until every item is in; never holds more than capacity.'''
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("%s:about to add %d messages", name, len(items))
+        start = 0
+        with self._not_full:
+            while start < len(items):
+                while len(self._items) >= self.capacity and not self._closed:
+                    self._not_full.wait()
+                if self._closed:
+                    self.dropped += len(items) - start
+                    raise PipelineClosed("%s: pipeline is closed" % name)
+                room = self.capacity - len(self._items)
+                chunk = items[start:start + room]
+                self._items.extend(chunk)
+                self.put_count += len(chunk)
+                self._unfinished += len(chunk)
+                start += room
+                self._not_empty.notify()
+        if debug:
+            logger.debug("%s:added %d messages", name, len(items))
+
+    def get_many(self, max_items=1024, name="Consumer"):
+        '''Blocks for the first message, then takes up to max_items.
+
+        Returns [] once the pipeline is closed and empty.
+        '''
+        with self._not_empty:
+            while not self._items:
+                if self._closed:
+                    return []
+                self._not_empty.wait()
+            n = min(max_items, len(self._items))
+            popleft = self._items.popleft
+            batch = [popleft() for _ in range(n)]
+            self._not_full.notify()
+            if self._items:
+                self._not_empty.notify()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s:got %d messages", name, len(batch))
+        return batch
+
+    # Same interface as Pipeline, for single messages
+    def set_message(self, value, name="Producer"):
+        self.put_many((value,), name)
+
+    def get_message(self, name="Consumer"):
+        batch = self.get_many(1, name)
+        return batch[0] if batch else CLOSED
+
+    def task_done(self, count=1):
+        '''Consumers call this after handling `count` messages.'''
+        with self._lock:
+            self.processed += count
+            self._unfinished -= count
+            if not self._unfinished:
+                self._all_done.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        '''Refuse new messages and wake every waiting producer and consumer.'''
+        with self._lock:
+            self._closed = True
+            self._not_full.notify_all()
+            self._not_empty.notify_all()
+
+    def drain(self, timeout=None):
+        '''Wait until every message put so far is processed; False on timeout.'''
+        with self._all_done:
+            return self._all_done.wait_for(lambda: not self._unfinished, timeout)
+
+    def shutdown(self, timeout=None):
+        '''close() + drain(timeout); messages still queued after that are dropped.'''
+        self.close()
+        if self.drain(timeout):
+            return True
+        with self._lock:
+            left = len(self._items)
+            self._items.clear()
+            self.dropped += left
+            self._unfinished -= left
+            if not self._unfinished:
+                self._all_done.notify_all()
+        return False
+
+
+class SPSCRingBuffer:
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self.head = 0    # next slot to read, written by the consumer only
+        self.tail = 0    # next slot to write, written by the producer only
+
+    @staticmethod
+    def _backoff(spins):
+        # Spin a little, then yield the GIL, then actually sleep
+        if spins < 100:
+            time.sleep(0)
+        else:
+            time.sleep(0.0001)
+
+    def put_many(self, items):
+        slots, capacity = self._slots, self.capacity
+        start, spins = 0, 0
+        while start < len(items):
+            tail = self.tail
+            room = capacity - (tail - self.head)
+            if not room:
+                self._backoff(spins)
+                spins += 1
+                continue
+            n = min(room, len(items) - start)
+            pos = tail % capacity
+            first = min(n, capacity - pos)
+            slots[pos:pos + first] = items[start:start + first]
+            if first < n:
+                slots[:n - first] = items[start + first:start + n]
+            # Publish only after the slots are filled
+            self.tail = tail + n
+            start += n
+
+    def get_many(self, max_items=1024):
+        spins = 0
+        while self.tail == self.head:
+            self._backoff(spins)
+            spins += 1
+        head = self.head
+        n = min(max_items, self.tail - head)
+        slots, capacity = self._slots, self.capacity
+        start = head % capacity
+        if start + n <= capacity:
+            batch = slots[start:start + n]
+            slots[start:start + n] = [None] * n
+        else:
+            wrapped = start + n - capacity
+            batch = slots[start:] + slots[:wrapped]
+            slots[start:] = [None] * (capacity - start)
+            slots[:wrapped] = [None] * wrapped
+        # Hand the slots back only after they are cleared
+        self.head = head + n
+        return batch
+
+    def set_message(self, value, name="Producer"):
+        self.put_many((value,))
+
+    def get_message(self, name="Consumer"):
+        return self.get_many(1)[0]
+
+
+if __name__ == "__main__":
+    # Benchmark: messages/sec through one producer and one consumer thread
+    from producer_consumer_using_events import Pipeline
+
+    N = 200000
+    BATCH = 256
+
+    def run(name, producer, consumer):
+        start = time.perf_counter()
+        threads = [threading.Thread(target=producer), threading.Thread(target=consumer)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        print("%-40s %12.0f messages/sec" % (name, N / elapsed))
+
+    def single(pipeline):
+        def producer():
+            for i in range(N):
+                pipeline.set_message(i, "Producer")
+
+        def consumer():
+            for _ in range(N):
+                pipeline.get_message("Consumer")
+        return producer, consumer
+
+    def batched(pipeline):
+        def producer():
+            for start in range(0, N, BATCH):
+                pipeline.put_many(list(range(start, min(N, start + BATCH))))
+
+        def consumer():
+            received = 0
+            while received < N:
+                received += len(pipeline.get_many(BATCH))
+        return producer, consumer
+
+    run("Pipeline (maxsize=2), 1 per call", *single(Pipeline()))
+    run("BatchPipeline(1024), 1 per call", *single(BatchPipeline(1024)))
+    run("BatchPipeline(1024), %d per call" % BATCH, *batched(BatchPipeline(1024)))
+    run("SPSCRingBuffer(1024), %d per call" % BATCH, *batched(SPSCRingBuffer(1024)))
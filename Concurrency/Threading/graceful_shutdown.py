@@ -0,0 +1,82 @@
+'''
+producer_consumer_using_events.py with a proper shutdown.
+
+There the consumer checks `event.is_set() or not pipeline.empty()` and then
+blocks in get(), so it can hang forever at shutdown or leave messages behind,
+and the producer can stay blocked in put() on a full queue.
+Here BatchPipeline.shutdown() closes the pipeline, which wakes every blocked
+thread: producers get PipelineClosed, consumers drain what is left and then get
+an empty batch, which is their signal to exit. Nothing polls.
+
+python graceful_shutdown.py --producers 4 --consumers 3 --run-time 0.5 --shutdown-timeout 1
+'''
+
+import argparse
+import concurrent.futures
+import logging
+import random
+import time
+
+from fast_pipeline import BatchPipeline, PipelineClosed
+
+
+def producer(pipeline, name, batch_size):
+    """Pretend we're getting numbers from the network."""
+    sent = 0
+    try:
+        while True:
+            pipeline.put_many([random.randint(1, 101) for _ in range(batch_size)], name)
+            sent += batch_size
+    except PipelineClosed:
+        logging.info("%s: pipeline closed after %d messages. Exiting", name, sent)
+    return sent
+
+
+def consumer(pipeline, name, batch_size, work_time):
+    """Pretend we're saving numbers in the database."""
+    stored = 0
+    while True:
+        batch = pipeline.get_many(batch_size, name)
+        if not batch:
+            break
+        if work_time:
+            time.sleep(work_time)
+        stored += len(batch)
+        pipeline.task_done(len(batch))
+    logging.info("%s: pipeline closed and drained after %d messages. Exiting", name, stored)
+    return stored
+
+
+def run(nprod, ncon, run_time, shutdown_timeout, capacity=1024, batch_size=64, work_time=0.0):
+    pipeline = BatchPipeline(capacity)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nprod + ncon) as executor:
+        futures = [executor.submit(producer, pipeline, "Producer-%d" % i, batch_size) for i in range(nprod)]
+        futures += [executor.submit(consumer, pipeline, "Consumer-%d" % i, batch_size, work_time)
+                    for i in range(ncon)]
+
+        time.sleep(run_time)
+        logging.info("Main: shutting down")
+        start = time.perf_counter()
+        drained = pipeline.shutdown(shutdown_timeout)
+        concurrent.futures.wait(futures)
+        elapsed = time.perf_counter() - start
+
+    logging.info("Main: %s in %0.3f s, put=%d processed=%d dropped=%d",
+                 "drained" if drained else "timed out", elapsed,
+                 pipeline.put_count, pipeline.processed, pipeline.dropped)
+    return pipeline
+
+
+if __name__ == "__main__":
+    format = "%(asctime)s: %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--producers", type=int, default=2)
+    parser.add_argument("-c", "--consumers", type=int, default=2)
+    parser.add_argument("--run-time", type=float, default=0.1)
+    parser.add_argument("--shutdown-timeout", type=float, default=1.0)
+    parser.add_argument("--work-time", type=float, default=0.0,
+                        help="simulated seconds of work per consumed batch")
+    ns = parser.parse_args()
+    run(ns.producers, ns.consumers, ns.run_time, ns.shutdown_timeout, work_time=ns.work_time)
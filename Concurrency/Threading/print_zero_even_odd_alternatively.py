@@ -1,9 +1,14 @@
 '''
 This is the example to show the usage of Lock in threading ...
+
+ZeroEvenOddSequenced does the same with turn_sequencer.TurnSequencer, which
+works for any number of threads and any order.
 '''
 
 from threading import Lock, Thread
 
+from turn_sequencer import TurnSequencer, zero_even_odd_order
+
 
 class ZeroEvenOdd:
     def __init__(self, n):
@@ -64,19 +69,54 @@ class ZeroEvenOdd:
         self.odd_mutex.release()
 
 
-zeroEvenOdd = ZeroEvenOdd(8)
-th_zero = Thread(target=zeroEvenOdd.zero, args=(zeroEvenOdd.printNumber, ))
-th_even = Thread(target=zeroEvenOdd.even, args=(zeroEvenOdd.printNumber, ))
-th_odd = Thread(target=zeroEvenOdd.odd, args=(zeroEvenOdd.printNumber, ))
+class ZeroEvenOddSequenced:
+    def __init__(self, n):
+        self.n = n
+        # parties: 0 -> zero, 1 -> odd, 2 -> even
+        self.sequencer = TurnSequencer(3, zero_even_odd_order)
+
+    def printNumber(self, num):
+        print(num)
+
+    def zero(self, printNumber: 'Callable[[int], None]') -> None:
+        for _ in range(self.n):
+            with self.sequencer.turn(0):
+                printNumber(0)
+
+    def even(self, printNumber: 'Callable[[int], None]') -> None:
+        for i in range(2, self.n + 1, 2):
+            with self.sequencer.turn(2):
+                printNumber(i)
+
+    def odd(self, printNumber: 'Callable[[int], None]') -> None:
+        for i in range(1, self.n + 1, 2):
+            with self.sequencer.turn(1):
+                printNumber(i)
+
+
+if __name__ == '__main__':
+    zeroEvenOdd = ZeroEvenOdd(8)
+    th_zero = Thread(target=zeroEvenOdd.zero, args=(zeroEvenOdd.printNumber, ))
+    th_even = Thread(target=zeroEvenOdd.even, args=(zeroEvenOdd.printNumber, ))
+    th_odd = Thread(target=zeroEvenOdd.odd, args=(zeroEvenOdd.printNumber, ))
+
 
+    threads = []
+    threads.append(th_even)
+    threads.append(th_odd)
+    threads.append(th_zero)
 
-threads = []
-threads.append(th_even)
-threads.append(th_odd)
-threads.append(th_zero)
+    for thread in threads:
+        thread.start()
 
-for thread in threads:
-    thread.start()
+    for thread in threads:
+        thread.join()
 
-for thread in threads:
-    thread.join()
+    sequenced = ZeroEvenOddSequenced(8)
+    threads = [Thread(target=sequenced.zero, args=(sequenced.printNumber, )),
+               Thread(target=sequenced.even, args=(sequenced.printNumber, )),
+               Thread(target=sequenced.odd, args=(sequenced.printNumber, ))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,223 @@
+'''
+Deterministic turn taking between threads, the general form of ZeroEvenOdd
+in print_zero_even_odd_alternatively.py.
+
+TurnSequencer         - K parties take turns in a fixed order: round robin by
+                        default, or order(turn) -> party for anything else
+                        (zero/odd/even is order(t) = 0 if t is even, else 1 or
+                        2 by the parity of (t + 1) // 2). Like ZeroEvenOdd every
+                        party has its own Lock, which is released only when the
+                        party's turn comes, so a handoff wakes exactly one thread.
+
+                            with sequencer.turn(party) as t:
+                                emit(value_for(t))
+
+BatchedTurnSequencer  - the same order, but the parties hand over blocks: each
+                        put(party, values) appends that party's next values,
+                        and whichever thread put last emits everything that is
+                        now complete, in turn order, as one list to sink().
+                        Nobody waits for a turn, a thread only blocks when its
+                        own backlog is over capacity.
+
+close() wakes every waiting party with SequencerClosed.
+'''
+
+import threading
+from collections import deque
+
+
+class SequencerClosed(Exception):
+    pass
+
+
+def _release_quietly(lock):
+    # Once closed, two threads may both try to open the same lock
+    try:
+        lock.release()
+    except RuntimeError:
+        pass
+
+
+class _Turn:
+    # A reusable context manager per party, cheaper than @contextmanager
+    __slots__ = ('sequencer', 'party')
+
+    def __init__(self, sequencer, party):
+        self.sequencer = sequencer
+        self.party = party
+
+    def __enter__(self):
+        return self.sequencer.wait(self.party)
+
+    def __exit__(self, *exc):
+        self.sequencer.advance()
+
+
+class TurnSequencer:
+    def __init__(self, parties, order=None):
+        self.parties = parties
+        self.order = order or (lambda turn: turn % parties)
+        self.turn_number = 0
+        self.closed = False
+        self._locks = [threading.Lock() for _ in range(parties)]
+        for party, lock in enumerate(self._locks):
+            if party != self.order(0):
+                lock.acquire()
+        self._turns = [_Turn(self, party) for party in range(parties)]
+
+    def wait(self, party, timeout=-1):
+        '''Blocks until it is party's turn and returns the turn number.'''
+        if not self._locks[party].acquire(timeout=timeout):
+            raise TimeoutError("party %d did not get its turn" % party)
+        if self.closed:
+            _release_quietly(self._locks[party])
+            raise SequencerClosed()
+        return self.turn_number
+
+    def advance(self):
+        '''Ends the current turn; only the party holding the turn may call it.'''
+        turn = self.turn_number + 1
+        self.turn_number = turn
+        if self.closed:
+            # close() left the locks of this turn and the next one alone: open
+            # both, so the next wait() of either party raises SequencerClosed
+            _release_quietly(self._locks[self.order(turn - 1)])
+            _release_quietly(self._locks[self.order(turn)])
+            return
+        self._locks[self.order(turn)].release()
+
+    def turn(self, party):
+        '''with sequencer.turn(party) as turn_number: ... (advances on exit)'''
+        return self._turns[party]
+
+    def close(self):
+        self.closed = True
+        # Wake the waiting parties, but not the one whose turn it is: it may be
+        # inside its turn, and its advance() opens the locks instead
+        current = self.order(self.turn_number)
+        for party, lock in enumerate(self._locks):
+            if party != current and lock.locked():
+                _release_quietly(lock)
+
+
+class BatchedTurnSequencer:
+    def __init__(self, parties, sink, order=None, capacity=4096):
+        self.parties = parties
+        self.sink = sink
+        self.order = order or (lambda turn: turn % parties)
+        self.capacity = capacity
+        self.turn_number = 0
+        self.closed = False
+        self._buffers = [deque() for _ in range(parties)]
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+
+    def put(self, party, values):
+        '''Adds party's next values; emits every value whose turn has come.'''
+        with self._lock:
+            buffer = self._buffers[party]
+            while buffer and len(buffer) + len(values) > self.capacity and not self.closed:
+                self._space.wait()
+            if self.closed:
+                raise SequencerClosed()
+            buffer.extend(values)
+            self._merge()
+
+    def _merge(self):
+        buffers, order = self._buffers, self.order
+        turn = self.turn_number
+        out = []
+        append = out.append
+        while True:
+            buffer = buffers[order(turn)]
+            if not buffer:
+                break
+            append(buffer.popleft())
+            turn += 1
+        if out:
+            self.turn_number = turn
+            self.sink(out)
+            self._space.notify_all()
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self._space.notify_all()
+
+
+def zero_even_odd_order(turn):
+    # 0 1 0 2 0 3 ...: zero on even turns, then odd (1) / even (2) by value
+    if turn % 2 == 0:
+        return 0
+    return 1 if ((turn + 1) // 2) % 2 == 1 else 2
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from print_zero_even_odd_alternatively import ZeroEvenOdd, ZeroEvenOddSequenced
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=100000)
+    parser.add_argument('--block', type=int, default=256)
+    ns = parser.parse_args()
+    n = ns.n
+    expected = [v for i in range(1, n + 1) for v in (0, i)]
+
+    def run_threads(targets):
+        threads = [threading.Thread(target=target) for target in targets]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def report(name, elapsed, handoffs, output):
+        assert output == expected, name
+        print('{:>36}: {:10.0f} values/s {:10.0f} handoffs/s'.format(
+            name, len(output) / elapsed, handoffs / elapsed))
+
+    # The current design: three Locks handed over once per value
+    out = []
+    zeo = ZeroEvenOdd(n)
+    elapsed = run_threads([lambda: zeo.zero(out.append), lambda: zeo.even(out.append),
+                           lambda: zeo.odd(out.append)])
+    report('ZeroEvenOdd (3 chained Locks)', elapsed, 2 * n, out)
+
+    # TurnSequencer, one value per turn
+    out = []
+    zeo = ZeroEvenOddSequenced(n)
+    elapsed = run_threads([lambda: zeo.zero(out.append), lambda: zeo.even(out.append),
+                           lambda: zeo.odd(out.append)])
+    report('ZeroEvenOddSequenced (TurnSequencer)', elapsed, 2 * n, out)
+
+    # BatchedTurnSequencer, blocks of --block values per put
+    for block in (16, ns.block):
+        out = []
+        batched = BatchedTurnSequencer(3, out.extend, zero_even_odd_order, capacity=4 * block)
+        puts = [0]
+
+        def put_blocks(party, values):
+            for i in range(0, len(values), block):
+                batched.put(party, values[i:i + block])
+                puts[0] += 1
+
+        elapsed = run_threads([lambda: put_blocks(0, [0] * n),
+                               lambda: put_blocks(1, list(range(1, n + 1, 2))),
+                               lambda: put_blocks(2, list(range(2, n + 1, 2)))])
+        report('BatchedTurnSequencer, block {}'.format(block), elapsed, puts[0], out)
+
+    # K = 4 round robin, interleaving four worker streams
+    out = []
+    sequencer = TurnSequencer(4)
+
+    def worker(party):
+        for i in range(n // 4):
+            with sequencer.turn(party):
+                out.append((party, i))
+
+    elapsed = run_threads([lambda p=p: worker(p) for p in range(4)])
+    assert out == [(p, i) for i in range(n // 4) for p in range(4)]
+    print('{:>36}: {:10.0f} values/s'.format('TurnSequencer, 4 parties round robin', len(out) / elapsed))
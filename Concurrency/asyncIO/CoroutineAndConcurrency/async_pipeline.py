@@ -0,0 +1,219 @@
+# An asyncio version of the @start_coroutine push pipelines.
+#
+# In coroutines_in_pipeline.py every target.send(item) runs the whole chain
+# below it before returning, so one slow sink (say a network writer) stalls
+# the source. Here every Stage owns a bounded queue and its own worker tasks:
+#
+#   - `await stage.send(item)` only waits while the stage's queue is full
+#     (backpressure), not for the downstream work itself
+#   - concurrency=N runs N workers, so I/O bound stages overlap
+#   - send_many(items) queues a whole list, only awaiting when the queue is full
+#
+# Stages compose like the generator ones, the target is the last argument:
+#
+#     sink = Stage(write_to_socket, concurrency=8)
+#     pipeline = Broadcast([Stage(match('python'), sink), Stage(match('go'), sink)])
+#
+# Existing generator stages plug in unchanged through CoroutineStage:
+#
+#     CoroutineStage(lambda target: grep('python', target), target=sink)
+#     CoroutineStage(printer)
+#
+# close() the head of the pipeline when done: every stage drains, then tells
+# its target. A target shared by several upstreams (sink above) only closes
+# once the last of them has closed. Sending to a closed stage raises
+# RuntimeError.
+
+import asyncio
+import logging
+
+
+class _Target:
+    # Counts the stages feeding this one, so a shared target closes only when
+    # the last of them closes
+
+    _upstreams = 0
+
+    def _add_upstream(self):
+        self._upstreams += 1
+
+    async def _upstream_closed(self):
+        self._upstreams -= 1
+        if self._upstreams <= 0:
+            await self.close()
+
+
+class Stage(_Target):
+    """Runs `await fn(item)` for every item; results that are not None go to target."""
+
+    def __init__(self, fn, target=None, concurrency=1, maxsize=100):
+        self.fn = fn
+        self.target = target
+        self.concurrency = concurrency
+        self.queue = asyncio.Queue(maxsize)
+        self._workers = []
+        self._closed = False
+        if target is not None:
+            target._add_upstream()
+
+    def _start(self):
+        # Workers need a running loop, so they start on the first send
+        if self._closed:
+            raise RuntimeError('{} is closed'.format(type(self).__name__))
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def send(self, item):
+        self._start()
+        await self.queue.put(item)
+
+    async def send_many(self, items):
+        self._start()
+        queue = self.queue
+        for item in items:
+            try:
+                queue.put_nowait(item)
+            except asyncio.QueueFull:
+                await queue.put(item)
+
+    async def _work(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self._process(item)
+            except Exception as e:
+                logging.warning('{} dropped an item: {!r}'.format(type(self).__name__, e))
+            finally:
+                self.queue.task_done()
+
+    async def _process(self, item):
+        result = await self.fn(item)
+        if result is not None and self.target is not None:
+            await self.target.send(result)
+
+    async def close(self):
+        """Wait until everything sent so far went through, then close downstream."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._workers:
+            await self.queue.join()
+            for worker in self._workers:
+                worker.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+            self._workers = []
+        if self.target is not None:
+            await self.target._upstream_closed()
+
+
+class Broadcast(_Target):
+    """Send every item to every target, like broadcast() in coroutines_in_pipeline.py"""
+
+    def __init__(self, targets):
+        self.targets = targets
+        self._closed = False
+        for target in targets:
+            target._add_upstream()
+
+    async def send(self, item):
+        for target in self.targets:
+            await target.send(item)
+
+    async def send_many(self, items):
+        for target in self.targets:
+            await target.send_many(items)
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for target in self.targets:
+            await target._upstream_closed()
+
+
+class _Bridge:
+    # Synchronous .send() for the generator stages, collects what they emit
+    def __init__(self):
+        self.items = []
+
+    def send(self, item):
+        self.items.append(item)
+
+
+class CoroutineStage(Stage):
+    """Wraps a @start_coroutine stage, e.g. CoroutineStage(lambda t: grep('go', t), target)
+
+    factory(bridge) builds the generator chain when there is an async target,
+    factory() when the chain is a sink (printer, bus_locations ...).
+    """
+
+    def __init__(self, factory, target=None, maxsize=100):
+        super().__init__(None, target, concurrency=1, maxsize=maxsize)
+        self.bridge = _Bridge() if target is not None else None
+        self.coroutine = factory(self.bridge) if target is not None else factory()
+
+    async def _process(self, item):
+        self.coroutine.send(item)
+        if self.bridge is not None and self.bridge.items:
+            emitted, self.bridge.items = self.bridge.items, []
+            await self.target.send_many(emitted)
+
+    async def close(self):
+        await super().close()
+        self.coroutine.close()
+
+
+if __name__ == '__main__':
+    import time
+    from coroutines_in_pipeline import broadcast, grep, printer
+    from starting_coroutine_using_decorator import start_coroutine
+
+    lines = ['{} line {}\n'.format(lang, i) for i in range(50) for lang in ('python', 'go', 'cpp')]
+    written = []
+
+    async def slow_writer(line):
+        # Pretend this is a network write taking 10ms
+        await asyncio.sleep(0.01)
+        written.append(line)
+
+    def match(pattern):
+        async def fn(line):
+            return line if pattern in line else None
+        return fn
+
+    @start_coroutine
+    def blocking_writer():
+        while True:
+            line = (yield)
+            time.sleep(0.01)
+            written.append(line)
+
+    # Generator pipeline: every send waits for the slow sink. Same work as the
+    # async pipeline below: the python and the cpp lines go to one writer.
+    start = time.perf_counter()
+    writer = blocking_writer()
+    sync_pipeline = broadcast([grep('python', writer), grep('cpp', writer)])
+    for line in lines:
+        sync_pipeline.send(line)
+    print('generator pipeline: {:0.2f} s for {} writes'.format(time.perf_counter() - start, len(written)))
+
+    async def main():
+        written.clear()
+        start = time.perf_counter()
+        sink = Stage(slow_writer, concurrency=10)
+        pipeline = Broadcast([
+            Stage(match('python'), sink),
+            # an unchanged generator stage in the middle of the async pipeline
+            CoroutineStage(lambda target: grep('cpp', target), target=sink),
+        ])
+        await pipeline.send_many(lines)
+        await pipeline.close()
+        print('async pipeline:     {:0.2f} s for {} writes'.format(time.perf_counter() - start, len(written)))
+
+        # and a generator sink at the end
+        tail = Stage(match('go line 4'), CoroutineStage(printer))
+        for line in lines:
+            await tail.send(line)
+        await tail.close()
+
+    asyncio.run(main())
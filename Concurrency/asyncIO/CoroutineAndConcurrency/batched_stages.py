@@ -0,0 +1,146 @@
+# Batched versions of the coroutine stages in coroutines_in_pipeline.py and
+# coroutines_in_pipeline_xml_parsing.py.
+#
+# A batched stage receives a list (a chunk of items) per send() and passes on
+# the filtered list, so the cost of resuming a generator is paid once per
+# chunk instead of once per item, and the per-item work runs in a list
+# comprehension.
+#
+#   batcher(size, target)      per-item  -> batched (flushes the rest on close())
+#   unbatcher(target)          batched   -> per-item, to reuse existing sinks
+#   fused_filter(fields, target)
+#       filter_on_field("route","22", filter_on_field("direction","North Bound", t))
+#       as one stage over every chunk: fused_filter({"route": "22",
+#       "direction": "North Bound"}, t)
+
+from starting_coroutine_using_decorator import start_coroutine
+
+
+@start_coroutine
+def batcher(size, target):
+    chunk = []
+    try:
+        while True:
+            chunk.append((yield))
+            if len(chunk) >= size:
+                target.send(chunk)
+                chunk = []
+    except GeneratorExit:
+        if chunk:
+            target.send(chunk)
+
+
+@start_coroutine
+def unbatcher(target):
+    while True:
+        chunk = (yield)
+        for item in chunk:
+            target.send(item)
+
+
+@start_coroutine
+def batch_grep(pattern, target):
+    while True:
+        lines = (yield)
+        matched = [line for line in lines if pattern in line]
+        if matched:
+            target.send(matched)
+
+
+@start_coroutine
+def batch_broadcast(targets):
+    while True:
+        chunk = (yield)
+        for target in targets:
+            target.send(chunk)
+
+
+@start_coroutine
+def batch_printer():
+    while True:
+        lines = (yield)
+        print(''.join(lines), end='')
+
+
+@start_coroutine
+def batch_filter_on_field(fieldname, value, target):
+    while True:
+        chunk = (yield)
+        matched = [d for d in chunk if d.get(fieldname) == value]
+        if matched:
+            target.send(matched)
+
+
+@start_coroutine
+def fused_filter(fields, target):
+    # One generator resume per chunk for all the predicates; each one runs as
+    # a list comprehension over what the previous one kept, so put the most
+    # selective field first.
+    fields = list(fields.items())
+    while True:
+        matched = (yield)
+        for name, value in fields:
+            matched = [d for d in matched if d.get(name) == value]
+            if not matched:
+                break
+        else:
+            target.send(matched)
+
+
+@start_coroutine
+def batch_bus_locations():
+    while True:
+        buses = (yield)
+        print('\n'.join("%(route)s,%(id)s,\"%(direction)s\",%(latitude)s,%(longitude)s" % bus
+                        for bus in buses))
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    from coroutines_in_pipeline_xml_parsing import filter_on_field
+
+    @start_coroutine
+    def counter(counts):
+        while True:
+            (yield)
+            counts[0] += 1
+
+    @start_coroutine
+    def batch_counter(counts):
+        while True:
+            counts[0] += len((yield))
+
+    random.seed(1)
+    buses = [{'route': str(random.randint(1, 40)), 'id': str(i),
+              'direction': random.choice(['North Bound', 'South Bound', 'East Bound', 'West Bound']),
+              'latitude': '41.9', 'longitude': '-87.6'} for i in range(500000)]
+
+    def run(name, pipeline, items, counts):
+        start = time.perf_counter()
+        for item in items:
+            pipeline.send(item)
+        pipeline.close()
+        elapsed = time.perf_counter() - start
+        print('{:>45}: {:10.0f} records/sec, {} matched'.format(name, len(buses) / elapsed, counts[0]))
+
+    counts = [0]
+    run('per item filter_on_field chain',
+        filter_on_field('route', '22', filter_on_field('direction', 'North Bound', counter(counts))),
+        buses, counts)
+
+    chunks = [buses[i:i + 1000] for i in range(0, len(buses), 1000)]
+    counts = [0]
+    run('batched filter_on_field chain (1000/chunk)',
+        batch_filter_on_field('route', '22', batch_filter_on_field('direction', 'North Bound',
+                                                                   batch_counter(counts))),
+        chunks, counts)
+    counts = [0]
+    run('fused_filter (1000/chunk)',
+        fused_filter({'route': '22', 'direction': 'North Bound'}, batch_counter(counts)),
+        chunks, counts)
+    counts = [0]
+    run('batcher -> fused_filter -> unbatcher',
+        batcher(1000, fused_filter({'route': '22', 'direction': 'North Bound'}, unbatcher(counter(counts)))),
+        buses, counts)
@@ -0,0 +1,340 @@
+# A columnar sink for the bus pipeline, instead of bus_locations() printing
+# every record with % formatting.
+#
+# BusColumns collects records into columns:
+# - latitude / longitude as array('d'), parsed once on the way in
+# - route, id and direction dictionary encoded: every distinct string is kept
+#   (interned) once and the column is an array('I') of codes
+#
+# It takes dicts (buses_to_dicts) or namedtuples (xml_records.RecordExtractor),
+# one per send() or a list per send() from the batched stages, so it can
+# replace bus_locations() / batch_bus_locations() at the end of either chain.
+# send() only appends the record to a pending list; every BATCH records the
+# columns are filled with one map() per column, which is what makes it as
+# fast as bus_locations() per record. A bad record (missing field, latitude
+# that is not a number) raises from the send() or query that converts its
+# batch; the other records of that batch are kept.
+#
+# The columns are written in bulk as CSV, as one binary file (a small JSON
+# header followed by the raw column buffers, little-endian whatever the
+# machine) or as NumPy .npy files, and can be queried with NumPy when it is
+# installed (plain Python otherwise).
+
+import json
+import os
+import sys
+from array import array
+from operator import attrgetter, itemgetter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'BUSCOL1\n'
+
+
+def _require_numpy(what):
+    if numpy is None:
+        raise RuntimeError('BusColumns.{} needs NumPy (pip install numpy)'.format(what))
+
+
+def _csv_field(value):
+    # csv.QUOTE_MINIMAL with the default dialect
+    if ',' in value or '"' in value or '\r' in value or '\n' in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+class StringColumn:
+    """Dictionary encoded strings: values holds each distinct string once."""
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+        self.codes = array('I')
+
+    def append(self, value):
+        try:
+            self.codes.append(self.index[value])
+        except KeyError:
+            self.index[value] = len(self.values)
+            self.codes.append(len(self.values))
+            self.values.append(sys.intern(value))
+
+    def extend(self, values):
+        index = self.index
+        # New strings get their codes in order of first appearance, as append()
+        for value in dict.fromkeys(values):
+            if value not in index:
+                index[value] = len(self.values)
+                self.values.append(sys.intern(value))
+        self.codes.extend(map(index.__getitem__, values))
+
+    def __getitem__(self, row):
+        return self.values[self.codes[row]]
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class BusColumns:
+
+    STRINGS = ('route', 'id', 'direction')
+    FLOATS = ('latitude', 'longitude')
+    BATCH = 4096
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.strings = {name: StringColumn() for name in self.STRINGS}
+        self.floats = {name: array('d') for name in self.FLOATS}
+        self._route, self._id, self._direction = (self.strings[n].append for n in self.STRINGS)
+        self._latitude, self._longitude = (self.floats[n].append for n in self.FLOATS)
+        self._pending = []
+
+    def __len__(self):
+        self._flush()
+        return len(self.floats['latitude'])
+
+    def send(self, record):
+        if isinstance(record, list):
+            self.send_many(record)
+            return
+        pending = self._pending
+        pending.append(record)
+        if len(pending) >= self.BATCH:
+            self._flush()
+
+    def send_many(self, records):
+        self._pending.extend(records)
+        if len(self._pending) >= self.BATCH:
+            self._flush()
+
+    def _flush(self):
+        batch = self._pending
+        if not batch:
+            return
+        self._pending = []
+        get = itemgetter if isinstance(batch[0], dict) else attrgetter
+        try:
+            # Everything is parsed before the first column grows
+            floats = [array('d', map(float, map(get(name), batch))) for name in self.FLOATS]
+            strings = [list(map(get(name), batch)) for name in self.STRINGS]
+        except (KeyError, AttributeError, TypeError, ValueError):
+            self._append_each(batch)
+            return
+        for name, values in zip(self.STRINGS, strings):
+            self.strings[name].extend(values)
+        for name, values in zip(self.FLOATS, floats):
+            self.floats[name].extend(values)
+
+    def _append_each(self, batch):
+        # A bad record, or dicts mixed with namedtuples: keep every good record,
+        # then raise the first error
+        error = None
+        for r in batch:
+            try:
+                if isinstance(r, dict):
+                    self._append(r['route'], r['id'], r['direction'], r['latitude'], r['longitude'])
+                else:
+                    self._append(r.route, r.id, r.direction, r.latitude, r.longitude)
+            except (KeyError, AttributeError, TypeError, ValueError) as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    def _append(self, route, id, direction, latitude, longitude):
+        # Parse first, so a bad value can't leave the columns different lengths
+        latitude, longitude = float(latitude), float(longitude)
+        self._route(route)
+        self._id(id)
+        self._direction(direction)
+        self._latitude(latitude)
+        self._longitude(longitude)
+
+    def close(self):
+        self._flush()
+
+    def row(self, i):
+        self._flush()
+        row = {name: column[i] for name, column in self.strings.items()}
+        row.update((name, column[i]) for name, column in self.floats.items())
+        return row
+
+    # Bulk output
+
+    def write_csv(self, path):
+        """The same file csv.writer would write, built without it: every
+        distinct string is quoted once, floats are repr()'d as csv does."""
+        self._flush()
+        strings = [map([_csv_field(v) for v in c.values].__getitem__, c.codes) for c in self.strings.values()]
+        floats = [map(repr, column) for column in self.floats.values()]
+        with open(path, 'w', newline='') as f:
+            f.write(','.join(self.STRINGS + self.FLOATS) + '\r\n')
+            f.writelines(map('{},{},{},{},{}\r\n'.format, *strings, *floats))
+
+    def write_binary(self, path):
+        """Codes as uint32 and floats as float64, little-endian on any machine."""
+        header = {'rows': len(self), 'floats': list(self.FLOATS), 'byteorder': 'little',
+                  'strings': {name: c.values for name, c in self.strings.items()}}
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            raw = json.dumps(header).encode()
+            f.write(len(raw).to_bytes(4, 'little'))
+            f.write(raw)
+            for column in [self.strings[name].codes for name in self.STRINGS] + \
+                          [self.floats[name] for name in self.FLOATS]:
+                if sys.byteorder != 'little':
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                column.tofile(f)
+
+    @classmethod
+    def read_binary(cls, path):
+        columns = cls()
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a BusColumns file'.format(path))
+            header = json.loads(f.read(int.from_bytes(f.read(4), 'little')))
+            rows = header['rows']
+            for name in cls.STRINGS:
+                column = columns.strings[name]
+                column.values = [sys.intern(v) for v in header['strings'][name]]
+                column.index = {v: i for i, v in enumerate(column.values)}
+                column.codes.fromfile(f, rows)
+            for name in cls.FLOATS:
+                columns.floats[name].fromfile(f, rows)
+        # Files written before the header had a byteorder are in native order
+        if header.get('byteorder', sys.byteorder) != sys.byteorder:
+            for column in [c.codes for c in columns.strings.values()] + list(columns.floats.values()):
+                column.byteswap()
+        return columns
+
+    def write_npy(self, directory):
+        """One <column>.npy per column; string columns as NumPy unicode arrays."""
+        _require_numpy('write_npy')
+        os.makedirs(directory, exist_ok=True)
+        for name in self.STRINGS + self.FLOATS:
+            numpy.save(os.path.join(directory, name + '.npy'), self.array(name))
+
+    # Queries
+
+    def array(self, name):
+        """A column as a NumPy array, a copy: BusColumns keeps growing."""
+        _require_numpy('array')
+        self._flush()
+        if name in self.floats:
+            # A view would lock the array('d') against appends while it lives
+            return numpy.frombuffer(self.floats[name], dtype=numpy.float64).copy()
+        column = self.strings[name]
+        return numpy.array(column.values)[numpy.frombuffer(column.codes, dtype=numpy.uint32)]
+
+    def select(self, **equals):
+        """Row numbers where every given string column equals its value."""
+        self._flush()
+        mask = None
+        for name, value in equals.items():
+            column = self.strings[name]
+            code = column.index.get(value)
+            if code is None:
+                return []
+            if numpy is not None:
+                hit = numpy.frombuffer(column.codes, dtype=numpy.uint32) == code
+                mask = hit if mask is None else mask & hit
+            else:
+                hit = [c == code for c in column.codes]
+                mask = hit if mask is None else [a and b for a, b in zip(mask, hit)]
+        if mask is None:
+            return list(range(len(self)))
+        if numpy is not None:
+            return numpy.flatnonzero(mask).tolist()
+        return [i for i, m in enumerate(mask) if m]
+
+    def within(self, lat_min, lat_max, lon_min, lon_max):
+        """Row numbers inside a latitude/longitude box."""
+        self._flush()
+        if numpy is not None:
+            # Views are fine here, they are gone before the next send()
+            lat, lon = (numpy.frombuffer(self.floats[n], dtype=numpy.float64) for n in self.FLOATS)
+            mask = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+            return numpy.flatnonzero(mask).tolist()
+        return [i for i, (lat, lon) in enumerate(zip(self.floats['latitude'], self.floats['longitude']))
+                if lat_min <= lat <= lat_max and lon_min <= lon <= lon_max]
+
+    def count_by(self, name):
+        """{value: rows} for a string column."""
+        self._flush()
+        column = self.strings[name]
+        if numpy is not None:
+            counts = numpy.bincount(numpy.frombuffer(column.codes, dtype=numpy.uint32),
+                                    minlength=len(column.values))
+        else:
+            counts = [0] * len(column.values)
+            for code in column.codes:
+                counts[code] += 1
+        return {value: int(n) for value, n in zip(column.values, counts) if n}
+
+
+if __name__ == '__main__':
+    import csv
+    import io
+    import random
+    import tempfile
+    import time
+    from contextlib import redirect_stdout
+
+    from coroutines_in_pipeline_xml_parsing import bus_locations
+
+    random.seed(1)
+    buses = [{'route': str(random.randint(1, 40)), 'id': str(random.randint(1000, 9999)),
+              'direction': random.choice(['North Bound', 'South Bound', 'East Bound', 'West Bound']),
+              'latitude': str(41.6 + random.random() * 0.5), 'longitude': str(-87.9 + random.random() * 0.4)}
+              for i in range(300000)]
+
+    sink = bus_locations()
+    out = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(out):
+        for bus in buses:
+            sink.send(bus)
+    print('bus_locations() to a StringIO: {:10.0f} records/sec'.format(len(buses) / (time.perf_counter() - start)))
+
+    columns = BusColumns()
+    start = time.perf_counter()
+    for bus in buses:
+        columns.send(bus)
+    columns.close()  # converts the last partial batch
+    print('BusColumns.send():             {:10.0f} records/sec'.format(len(buses) / (time.perf_counter() - start)))
+    columns.clear()
+    start = time.perf_counter()
+    for i in range(0, len(buses), 1000):
+        columns.send(buses[i:i + 1000])
+    columns.close()
+    print('BusColumns.send(1000 records): {:10.0f} records/sec'.format(len(buses) / (time.perf_counter() - start)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, write in [('csv', lambda: columns.write_csv(os.path.join(tmp, 'buses.csv'))),
+                            ('binary', lambda: columns.write_binary(os.path.join(tmp, 'buses.bin'))),
+                            ('npy', lambda: columns.write_npy(os.path.join(tmp, 'npy')))]:
+            if name == 'npy' and numpy is None:
+                continue
+            start = time.perf_counter()
+            write()
+            print('write_{:7}{:8.3f} s'.format(name + ':', time.perf_counter() - start))
+        with open(os.path.join(tmp, 'buses.csv'), newline='') as f:
+            assert next(csv.reader(f)) == list(BusColumns.STRINGS + BusColumns.FLOATS)
+            assert [row for i, row in enumerate(csv.reader(f)) if i % 997 == 0] == \
+                [[str(v) for v in columns.row(i).values()] for i in range(0, len(buses), 997)]
+        again = BusColumns.read_binary(os.path.join(tmp, 'buses.bin'))
+        assert [again.row(i) for i in range(0, len(buses), 997)] == [columns.row(i) for i in range(0, len(buses), 997)]
+
+    start = time.perf_counter()
+    rows = columns.select(route='22', direction='North Bound')
+    box = columns.within(41.85, 41.95, -87.7, -87.6)
+    per_direction = columns.count_by('direction')
+    print('select + within + count_by: {:0.4f} s ({} rows on route 22 north, {} in the box)'.format(
+        time.perf_counter() - start, len(rows), len(box)))
+    assert rows == [i for i, b in enumerate(buses) if b['route'] == '22' and b['direction'] == 'North Bound']
+    print(per_direction)
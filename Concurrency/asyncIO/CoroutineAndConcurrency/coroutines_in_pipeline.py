@@ -1,5 +1,6 @@
 # An example of broadcasting a data stream onto multiple coroutine targets.
 from starting_coroutine_using_decorator import start_coroutine
+from tracing import tracer
 # A data source.  This is not a coroutine, but it sends
 # data into one (target)
 
@@ -9,7 +10,8 @@ def follow(thefile, target):
     #thefile.seek(0,2)      # Go to the end of the file
     while True:
          line = thefile.readline()
-         print("Reading line", line)
+         if tracer.enabled:
+             tracer.emit('follow', line)
          if not line:
              time.sleep(0.1)    # Sleep briefly
              continue
@@ -20,7 +22,8 @@ def follow(thefile, target):
 def grep(pattern,target):
     while True:
         line = (yield)           # Receive a line
-        print("Grep got a line", line)
+        if tracer.enabled:
+            tracer.emit('grep', pattern, line)
         if pattern in line:
             target.send(line)    # Send to next stage   bgs vv
 
@@ -39,6 +42,7 @@ def broadcast(targets):
         for target in targets:
             target.send(item)
 if __name__ == '__main__':
+    # tracer.enable()   # trace every stage to stderr
     with open("access-log.txt") as f:
         follow(f, broadcast([grep('python',printer()), grep('go',printer()),
                   grep('cpp',printer())])
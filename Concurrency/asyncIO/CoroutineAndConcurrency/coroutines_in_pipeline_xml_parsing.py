@@ -5,12 +5,14 @@
 # and process it as a dict
 
 from starting_coroutine_using_decorator import start_coroutine
+from tracing import tracer
 
 @start_coroutine
 def buses_to_dicts(target):
     while True:
         event, value = (yield)
-        print("buses_to_dicts event, value", event, value[0])
+        if tracer.enabled:
+            tracer.emit('buses_to_dicts', event, value[0])
         # Look for the start of a <bus> element
         if event == 'start' and value[0] == 'bus':
             busdict = { }
@@ -31,7 +33,8 @@ def buses_to_dicts(target):
 def filter_on_field(fieldname,value,target):
     while True:
         d = (yield)
-        print("filter_on_field d",d)
+        if tracer.enabled:
+            tracer.emit('filter_on_field', fieldname, d)
         if d.get(fieldname) == value:
             target.send(d)
 
@@ -47,6 +50,8 @@ if __name__ == '__main__':
     import xml.sax
     from cosax_eventhandler import EventHandler
 
+    # tracer.enable()   # trace every stage to stderr
+
     xml.sax.parse("allroutes.xml",
               EventHandler(
                    buses_to_dicts(
@@ -0,0 +1,160 @@
+# Parallel parsing of record-oriented XML, like the <bus> feed in allroutes.xml
+#
+# xml.sax.parse("allroutes.xml", EventHandler(...)) uses one core. When the
+# file is just a list of independent records we can:
+#
+# - mmap the file and cut it into byte ranges, moving every cut forward to the
+#   next <bus> start tag, so each range holds whole records only
+# - parse the ranges in a ProcessPoolExecutor; every worker maps the file
+#   itself (only offsets are pickled), feeds the parser a root start tag, a
+#   memoryview of its range and the end tag (the range is never copied), and
+#   runs the same EventHandler -> buses_to_dicts -> filter_on_field chain
+# - merge the per-chunk results in file order (ordered=True, same output as
+#   the serial pipeline) or as they finish (ordered=False)
+#
+# fields=('route', 'id', ...) runs xml_records.RecordExtractor in the workers
+# instead and yields its namedtuples with those fields.
+#
+# Limits: the record tag must not appear inside CDATA or comments, the records
+# must not use entities declared in a DTD, and the file has to be UTF-8.
+
+import concurrent.futures
+import mmap
+import os
+import xml.sax
+
+from cosax_eventhandler import EventHandler
+from coroutines_in_pipeline_xml_parsing import buses_to_dicts, filter_on_field
+from starting_coroutine_using_decorator import start_coroutine
+from xml_records import RecordExtractor
+
+
+def _find_tag(mm, tag, start, end):
+    # Next b'<bus' followed by '>', whitespace or '/', so <buses> does not match
+    pos = start
+    while True:
+        pos = mm.find(tag, pos, end)
+        if pos == -1 or pos + len(tag) >= end or mm[pos + len(tag)] in b'> \t\r\n/':
+            return pos
+        pos += len(tag)
+
+
+def split_records(path, record_tag, nchunks):
+    """Byte ranges [(start, end), ...] of path that each hold whole records."""
+    open_tag = ('<' + record_tag).encode()
+    close_tag = ('</' + record_tag + '>').encode()
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        first = _find_tag(mm, open_tag, 0, len(mm))
+        last = mm.rfind(close_tag)
+        if first == -1 or last == -1:
+            return []
+        end = last + len(close_tag)
+        step = max(1, (end - first) // nchunks)
+        cuts = [first]
+        for i in range(1, nchunks):
+            cut = _find_tag(mm, open_tag, max(first + i * step, cuts[-1] + 1), end)
+            if cut == -1:
+                break
+            cuts.append(cut)
+        cuts.append(end)
+    return [(a, b) for a, b in zip(cuts, cuts[1:]) if a < b]
+
+
+@start_coroutine
+def _collect(out):
+    while True:
+        out.append((yield))
+
+
+def parse_chunk(path, start, end, record_tag, filters, fields):
+    """Worker: parse path[start:end] (whole records) and return the kept records."""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            memoryview(mm) as whole, whole[start:end] as records:
+        pieces = (b'<chunk>', records, b'</chunk>')
+        if fields:
+            extractor = RecordExtractor(record_tag, fields, filters)
+            return [tuple(record) for record in extractor.parse_pieces(pieces)]
+        out = []
+        target = _collect(out)
+        for fieldname, value in reversed(list(filters.items())):
+            target = filter_on_field(fieldname, value, target)
+        # buses_to_dicts looks for <bus>, so without fields only that feed works
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(EventHandler(buses_to_dicts(target)))
+        for piece in pieces:
+            parser.feed(piece)
+        parser.close()
+        return out
+
+
+def parse_parallel(path, filters=None, record_tag='bus', workers=None,
+                   chunks_per_worker=4, ordered=True, fields=None):
+    """Yield the records of path that pass filters ({field: value}).
+
+    fields: None for the dicts of the buses_to_dicts pipeline, or a sequence
+    of field names for RecordExtractor namedtuples.
+    """
+    if fields is not None:
+        # fields=True or fields='route' would otherwise fail deep inside a worker
+        names = tuple(fields) if isinstance(fields, (tuple, list)) else ()
+        if not names or not all(isinstance(name, str) for name in names):
+            raise ValueError('fields must be a tuple or list of field names, not {!r}'.format(fields))
+        fields = names
+    elif record_tag != 'bus':
+        # buses_to_dicts only builds records from <bus>, it would find nothing
+        raise ValueError('record_tag {!r} needs fields=(field, ...)'.format(record_tag))
+    # Not a generator itself, so a bad call fails here and not on first next()
+    return _parse_parallel(path, dict(filters or {}), record_tag, workers, chunks_per_worker, ordered, fields)
+
+
+def _parse_parallel(path, filters, record_tag, workers, chunks_per_worker, ordered, fields):
+    workers = workers or os.cpu_count()
+    ranges = split_records(path, record_tag, workers * chunks_per_worker)
+    Record = RecordExtractor(record_tag, fields, filters).Record if fields else None
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(parse_chunk, path, start, end, record_tag, filters, fields)
+                   for start, end in ranges]
+        done = futures if ordered else concurrent.futures.as_completed(futures)
+        for future in done:
+            for record in future.result():
+                yield Record(*record) if Record else record
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from xml_records import BUS_FIELDS, write_bus_feed
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--buses', type=int, default=100000)
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count())
+    ns = parser.parse_args()
+
+    path = write_bus_feed(ns.buses)
+    size_mb = os.path.getsize(path) / (1 << 20)
+    filters = {'route': '22', 'direction': 'North Bound'}
+
+    try:
+        serial = []
+        start = time.perf_counter()
+        xml.sax.parse(path, EventHandler(buses_to_dicts(
+            filter_on_field('route', '22', filter_on_field('direction', 'North Bound', _collect(serial))))))
+        print('{:0.1f} MB, {} workers, {} cpus'.format(size_mb, ns.workers, os.cpu_count()))
+        print('{:>35}: {:6.1f} MB/s'.format('serial sax pipeline', size_mb / (time.perf_counter() - start)))
+
+        for name, kwargs in [('parallel sax pipeline, ordered', {}),
+                             ('parallel sax pipeline, unordered', {'ordered': False}),
+                             ('parallel RecordExtractor, ordered', {'fields': BUS_FIELDS})]:
+            start = time.perf_counter()
+            result = list(parse_parallel(path, filters, workers=ns.workers, **kwargs))
+            elapsed = time.perf_counter() - start
+            if 'fields' in kwargs:
+                assert [tuple(d[f] for f in BUS_FIELDS) for d in serial] == [tuple(r) for r in result]
+            elif kwargs.get('ordered', True):
+                assert result == serial
+            else:
+                assert sorted(map(sorted, map(dict.items, result))) == sorted(map(sorted, map(dict.items, serial)))
+            print('{:>35}: {:6.1f} MB/s'.format(name, size_mb / elapsed))
+    finally:
+        os.remove(path)
@@ -0,0 +1,119 @@
+# Lightweight tracing hook for hot paths (crawler, coroutine pipelines).
+# It sits next to the pipelines that import it as `tracing`; the crawler one
+# directory up imports it as `CoroutineAndConcurrency.tracing`.
+#
+# Call sites guard on a plain attribute, so a disabled tracer costs one
+# attribute lookup and no formatting:
+#
+#     if tracer.enabled:
+#         tracer.emit('fetch', url)
+#
+# When enabled, emit() appends the event to a deque and returns: no lock, no
+# batch bookkeeping. A background writer thread wakes every `interval`
+# seconds, drains the deque in batches of `batch_size` and formats and writes
+# them, so the hot path never blocks on stdout / file I/O. deque.append and
+# popleft are thread-safe, so emit() may be called from any thread, and
+# nothing is lost when the writer drains while other threads append.
+#
+# The stream decides the format. A binary file (open(path, 'wb')) gets whole
+# batches pickled, with no per-event formatting; read_trace() / python
+# tracing.py <file> turns them into text after the run. A text stream (the
+# default, sys.stderr) gets one formatted line per event, which the writer
+# still does under the GIL: it costs about what the print() it replaced did
+# (integer time.time_ns() stamps already format twice as fast as %.6f
+# floats). tracing_benchmark.py on one core, grep lines/sec: print 270k,
+# text tracing 125k, binary tracing 190k-265k. Binary tracing gets to about
+# print speed while keeping timestamps and the I/O off the hot path; text
+# tracing does not. So trace to a binary file unless you are watching the
+# output live.
+
+import atexit
+import io
+import pickle
+import sys
+import threading
+import time
+from collections import deque
+
+
+class Tracer:
+
+    def __init__(self):
+        self.enabled = False
+        self._events = deque()
+        self._stop = None
+        self._writer = None
+
+    def enable(self, stream=None, batch_size=1000, interval=0.05):
+        # A binary stream gets pickled batches, see read_trace()
+        if self.enabled:
+            self.disable()
+        stream = stream or sys.stderr
+        binary = not isinstance(stream, io.TextIOBase)
+        self._events = deque()
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._write_events,
+                                        args=(stream, self._events, self._stop,
+                                              batch_size, binary, interval),
+                                        name='tracer-writer', daemon=True)
+        self._writer.start()
+        self.enabled = True
+
+    def disable(self):
+        """Stop tracing; returns once everything emitted so far is written."""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        self._writer.join()
+        self._writer = self._stop = None
+
+    def emit(self, event, *args):
+        self._events.append((time.time_ns(), event, args))
+
+    @staticmethod
+    def _write_events(stream, events, stop, batch_size, binary, interval):
+        popleft = events.popleft
+        while True:
+            stopping = stop.wait(interval)
+            # Only this thread pops, so len(events) can only grow meanwhile
+            while events:
+                batch = [popleft() for _ in range(min(len(events), batch_size))]
+                if binary:
+                    try:
+                        pickle.dump(batch, stream, pickle.HIGHEST_PROTOCOL)
+                    except (pickle.PicklingError, TypeError, AttributeError):
+                        # Some args can't be pickled, keep their text instead
+                        pickle.dump([(ts, event, tuple(map(str, args))) for ts, event, args in batch],
+                                    stream, pickle.HIGHEST_PROTOCOL)
+                else:
+                    stream.write(format_events(batch))
+            stream.flush()
+            if stopping:
+                break
+
+
+def format_events(events):
+    # ts is time.time_ns(): %d is much cheaper than formatting a float
+    return ''.join(['%d %s %s\n' % (ts, event, ' '.join(map(str, args))) for ts, event, args in events])
+
+
+def read_trace(path):
+    """Yield the (time_ns, event, args) of a trace written to a binary file."""
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            yield from batch
+
+
+tracer = Tracer()
+atexit.register(tracer.disable)
+
+
+if __name__ == '__main__':
+    # python tracing.py trace.bin: print a binary trace as text
+    for ts, event, args in read_trace(sys.argv[1]):
+        sys.stdout.write(format_events([(ts, event, args)]))
@@ -0,0 +1,83 @@
+# Throughput of the grep / filter_on_field pipelines with the old per-item
+# print, with tracing disabled and with tracing enabled (batched writer thread,
+# to a text or a binary stream). All output goes to os.devnull so we measure the cost of
+# writing, not the terminal. The enabled runs include the writer finishing.
+
+import contextlib
+import os
+import time
+
+from starting_coroutine_using_decorator import start_coroutine
+from coroutines_in_pipeline import grep, broadcast
+from coroutines_in_pipeline_xml_parsing import filter_on_field
+from tracing import tracer
+
+
+@start_coroutine
+def print_grep(pattern, target):
+    # grep as it was, printing every line it receives
+    while True:
+        line = (yield)
+        print("Grep got a line", line)
+        if pattern in line:
+            target.send(line)
+
+
+@start_coroutine
+def print_filter_on_field(fieldname, value, target):
+    while True:
+        d = (yield)
+        print("filter_on_field d", d)
+        if d.get(fieldname) == value:
+            target.send(d)
+
+
+@start_coroutine
+def null_sink():
+    while True:
+        (yield)
+
+
+def run(name, pipeline, items, trace_to=None):
+    start = time.perf_counter()
+    if trace_to is not None:
+        tracer.enable(trace_to)
+    for item in items:
+        pipeline.send(item)
+    # Waits for the writer thread, so its formatting is counted as well
+    tracer.disable()
+    elapsed = time.perf_counter() - start
+    print('{:>32}: {:10.0f} items/sec'.format(name, len(items) / elapsed))
+
+
+if __name__ == '__main__':
+    lines = ['GET /downloads/{}/release.tar.gz HTTP/1.1'.format(lang)
+             for lang in ('python', 'go', 'cpp', 'rust') * 50000]
+    buses = [{'route': str(i % 40), 'direction': 'North Bound', 'id': str(i)} for i in range(200000)]
+
+    def grep_pipeline(stage):
+        return broadcast([stage('python', null_sink()), stage('go', null_sink()), stage('cpp', null_sink())])
+
+    def filter_pipeline(stage):
+        return stage('route', '22', stage('direction', 'North Bound', null_sink()))
+
+    with open(os.devnull, 'w') as devnull, open(os.devnull, 'wb') as binary_devnull:
+        with contextlib.redirect_stdout(devnull):
+            old_grep, old_filter = grep_pipeline(print_grep), filter_pipeline(print_filter_on_field)
+            start = time.perf_counter()
+            for line in lines:
+                old_grep.send(line)
+            old_grep_rate = len(lines) / (time.perf_counter() - start)
+            start = time.perf_counter()
+            for bus in buses:
+                old_filter.send(bus)
+            old_filter_rate = len(buses) / (time.perf_counter() - start)
+        print('{:>32}: {:10.0f} items/sec'.format('grep, print per line', old_grep_rate))
+        print('{:>32}: {:10.0f} items/sec'.format('filter_on_field, print per item', old_filter_rate))
+
+        run('grep, tracing disabled', grep_pipeline(grep), lines)
+        run('filter_on_field, tracing disabled', filter_pipeline(filter_on_field), buses)
+        run('grep, text tracing', grep_pipeline(grep), lines, devnull)
+        run('filter_on_field, text tracing', filter_pipeline(filter_on_field), buses, devnull)
+        run('grep, binary tracing', grep_pipeline(grep), lines, binary_devnull)
+        run('filter_on_field, binary tracing', filter_pipeline(filter_on_field), buses, binary_devnull)
@@ -0,0 +1,179 @@
+# Streaming XML -> records, replacing EventHandler -> buses_to_dicts -> filter_on_field
+#
+# cosax_eventhandler.EventHandler sends every startElement/characters/endElement
+# through a coroutine and copies the attributes each time, buses_to_dicts then
+# joins text fragments into a dict per <bus>. Here expat callbacks do it all:
+#
+# - the file is fed to expat in big buffers (buffer_text=True, so each text
+#   node normally arrives in one piece)
+# - text is only collected inside the configured fields; outside them the
+#   character handler is not even installed
+# - records are namedtuples with just those fields
+# - filters like filter_on_field("route", "22") are checked as soon as that
+#   field ends; a record failing one stops collecting and is never built,
+#   and so is a record that lacks a filtered field
+#
+# Records are yielded after every buffer, so memory stays constant.
+
+import tempfile
+import xml.parsers.expat
+from collections import namedtuple
+
+
+class RecordExtractor:
+
+    def __init__(self, record_tag, fields, filters=None, record_name='Record'):
+        self.record_tag = record_tag
+        self.fields = tuple(fields)
+        self.filters = dict(filters or {})
+        self.Record = namedtuple(record_name, self.fields)
+        # Filter fields are tracked even when they are not part of the record
+        tracked = list(self.fields) + [f for f in self.filters if f not in self.fields]
+        self._index = {name: i for i, name in enumerate(tracked)}
+        self._width = len(tracked)
+
+    def _make_parser(self, out):
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.buffer_size = 1 << 16
+        record_tag, index, filters = self.record_tag, self._index, self.filters
+        n_fields, Record = len(self.fields), self.Record
+        filtered = [index[name] for name in filters]
+        state = {'values': None, 'field': None, 'text': []}
+
+        def chars(data):
+            state['text'].append(data)
+
+        def start(name, attrs):
+            if name == record_tag:
+                state['values'] = [None] * self._width
+            elif state['values'] is not None and name in index:
+                state['field'] = name
+                state['text'] = []
+                parser.CharacterDataHandler = chars
+
+        def end(name):
+            values = state['values']
+            if values is None:
+                return
+            if name == state['field']:
+                parser.CharacterDataHandler = None
+                state['field'] = None
+                value = ''.join(state['text'])
+                wanted = filters.get(name)
+                if wanted is not None and value != wanted:
+                    # Pushed-down filter failed: skip the rest of this record
+                    state['values'] = None
+                    return
+                values[index[name]] = value
+            elif name == record_tag:
+                # A record without a filtered field fails that filter too
+                if all(values[i] is not None for i in filtered):
+                    out.append(Record(*values[:n_fields]))
+                state['values'] = None
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        return parser
+
+    def iterparse(self, source, chunk_size=1 << 20):
+        """Yield records from a path or binary file object."""
+        f = open(source, 'rb') if isinstance(source, str) else source
+        try:
+            records = []
+            parser = self._make_parser(records)
+            while True:
+                chunk = f.read(chunk_size)
+                parser.Parse(chunk, not chunk)
+                if records:
+                    yield from records
+                    records.clear()
+                if not chunk:
+                    break
+        finally:
+            if f is not source:
+                f.close()
+
+    def parse_pieces(self, pieces):
+        """Records of a document given as bytes-like pieces (bytes, memoryview
+        of an mmap, ...), parsed in order without joining them."""
+        records = []
+        parser = self._make_parser(records)
+        for piece in pieces:
+            parser.Parse(piece, False)
+        parser.Parse(b'', True)
+        return records
+
+    def send_to(self, source, target, chunk_size=1 << 20):
+        """Push records into a coroutine pipeline, like xml.sax.parse + EventHandler."""
+        for record in self.iterparse(source, chunk_size):
+            target.send(record)
+
+
+BUS_FIELDS = ('route', 'id', 'direction', 'latitude', 'longitude')
+
+
+def write_bus_feed(buses, source='allroutes.xml'):
+    """Write a big allroutes.xml-style feed, the <bus> records of source
+    repeated up to `buses` of them, to a temporary file; returns its path."""
+    with open(source) as f:
+        text = f.read()
+    head, rest = text.split('<bus>', 1)
+    body, tail = ('<bus>' + rest).rsplit('</bus>', 1)
+    records = [b + '</bus>' for b in body.split('</bus>') if b.strip()]
+    with tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False) as big:
+        big.write(head)
+        for i in range(buses):
+            big.write(records[i % len(records)])
+        big.write(tail)
+    return big.name
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import time
+    import xml.sax
+
+    from starting_coroutine_using_decorator import start_coroutine
+    from cosax_eventhandler import EventHandler
+    from coroutines_in_pipeline_xml_parsing import buses_to_dicts, filter_on_field
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--buses', type=int, default=200000)
+    ns = parser.parse_args()
+
+    path = write_bus_feed(ns.buses)
+    size_mb = os.path.getsize(path) / (1 << 20)
+
+    @start_coroutine
+    def collect(out):
+        while True:
+            out.append((yield))
+
+    try:
+        old = []
+        start = time.perf_counter()
+        xml.sax.parse(path, EventHandler(buses_to_dicts(
+            filter_on_field('route', '22', filter_on_field('direction', 'North Bound', collect(old))))))
+        old_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        extractor = RecordExtractor('bus', BUS_FIELDS, {'route': '22', 'direction': 'North Bound'}, 'Bus')
+        new = list(extractor.iterparse(path))
+        new_time = time.perf_counter() - start
+
+        # Upper bound: expat over the same file with no Python callbacks
+        start = time.perf_counter()
+        bare = xml.parsers.expat.ParserCreate()
+        with open(path, 'rb') as f:
+            bare.ParseFile(f)
+        bare_time = time.perf_counter() - start
+
+        assert [tuple(d[f] for f in BUS_FIELDS) for d in old] == [tuple(r) for r in new]
+        print('{:0.1f} MB, {} matching buses'.format(size_mb, len(new)))
+        print('sax EventHandler + buses_to_dicts + filters: {:6.1f} MB/s'.format(size_mb / old_time))
+        print('RecordExtractor with pushed-down filters:    {:6.1f} MB/s'.format(size_mb / new_time))
+        print('expat without callbacks:                     {:6.1f} MB/s'.format(size_mb / bare_time))
+    finally:
+        os.remove(path)
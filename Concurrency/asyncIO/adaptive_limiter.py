@@ -0,0 +1,233 @@
+# An adaptive replacement for asyncio.BoundedSemaphore(N)
+#
+# The right N depends on how fast the backend is right now. AdaptiveLimiter
+# is used the same way (`async with limiter:`) but moves its limit:
+#
+#   'aimd'      +1 per limit's worth of successful requests, * backoff on an
+#               error or on latency over `latency_threshold`
+#   'gradient'  Vegas/gradient style, once per window of ~limit requests:
+#               compares the window's mean latency with the no-load baseline
+#               (the lowest seen, slowly drifting up), limit * min(1, tolerance
+#               * baseline / latency) plus sqrt(limit) of headroom, smoothed.
+#               A window with errors multiplies the limit by backoff instead.
+#
+# An exception leaving the `async with` block counts as an error, or call
+# limiter.failed() inside the block (e.g. for a 503 response). The limit only
+# grows while it is actually used, so an idle limiter does not drift up.
+#
+#   limiter.limit          current limit (int)
+#   limiter.in_flight      requests holding a slot
+#   limiter.waiting        requests queued for a slot
+#   limiter.wait_percentile(99)   queue wait times (last 1000)
+
+import asyncio
+import math
+import time
+from collections import deque
+
+
+class _Permit:
+    __slots__ = ('start', 'failed')
+
+    def __init__(self, start):
+        self.start = start
+        self.failed = False
+
+
+class AdaptiveLimiter:
+
+    def __init__(self, initial_limit=10, min_limit=1, max_limit=1000, algorithm='gradient',
+                 backoff=0.9, latency_threshold=None, tolerance=1.5, smoothing=0.2):
+        if algorithm not in ('aimd', 'gradient'):
+            raise ValueError('algorithm must be aimd or gradient')
+        self._limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.algorithm = algorithm
+        self.backoff = backoff
+        self.latency_threshold = latency_threshold
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.baseline = None       # no-load latency estimate (gradient)
+        self._window_latency = 0.0
+        self._window_count = 0
+        self._window_errors = 0
+        self.in_flight = 0
+        self.errors = 0
+        self.completed = 0
+        self._waiters = deque()
+        self._permits = {}         # task -> stack of permits, for nested `async with`
+        self.wait_times = deque(maxlen=1000)
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def wait_percentile(self, p):
+        if not self.wait_times:
+            return 0.0
+        waits = sorted(self.wait_times)
+        return waits[min(len(waits) - 1, int(len(waits) * p / 100))]
+
+    async def __aenter__(self):
+        waiting = time.perf_counter()
+        if self.in_flight >= self.limit or self._waiters:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Got a slot and was cancelled at the same time: pass it on
+                    self.in_flight -= 1
+                    self._wake()
+                else:
+                    self._waiters.remove(waiter)
+                raise
+        else:
+            self.in_flight += 1
+        start = time.perf_counter()
+        self.wait_times.append(start - waiting)
+        self._permits.setdefault(asyncio.current_task(), []).append(_Permit(start))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        task = asyncio.current_task()
+        permits = self._permits[task]
+        permit = permits.pop()
+        if not permits:
+            del self._permits[task]
+        self.in_flight -= 1
+        failed = permit.failed or (exc_type is not None and exc_type is not asyncio.CancelledError)
+        self._update(time.perf_counter() - permit.start, failed)
+        self._wake()
+
+    def failed(self):
+        """Count the request of the current task as an error."""
+        self._permits[asyncio.current_task()][-1].failed = True
+
+    def _wake(self):
+        # Slots are handed over directly, so a newcomer can't jump the queue
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _update(self, latency, failed):
+        self.completed += 1
+        if failed:
+            self.errors += 1
+        if self.algorithm == 'aimd':
+            self._aimd(latency, failed)
+        else:
+            self._window_latency += latency
+            self._window_count += 1
+            self._window_errors += failed
+            if self._window_count >= max(5, self._limit):
+                self._gradient(self._window_latency / self._window_count, self._window_errors)
+                self._window_latency, self._window_count, self._window_errors = 0.0, 0, 0
+
+    def _aimd(self, latency, failed):
+        limit = self._limit
+        if failed or (self.latency_threshold is not None and latency > self.latency_threshold):
+            limit *= self.backoff
+        elif self.in_flight + 1 >= limit / 2:
+            limit += 1 / limit
+        self._set_limit(limit)
+
+    def _gradient(self, latency, errors):
+        limit = self._limit
+        if errors:
+            self._set_limit(limit * self.backoff)
+            return
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            # Drift up, so a backend that got slower for good is followed
+            self.baseline += (latency - self.baseline) * 0.01
+        gradient = max(0.5, min(1.0, self.tolerance * self.baseline / latency))
+        headroom = math.sqrt(limit) if self.in_flight + 1 >= limit / 2 else 0
+        new_limit = limit * gradient + headroom
+        self._set_limit(limit * (1 - self.smoothing) + new_limit * self.smoothing)
+
+    def _set_limit(self, limit):
+        self._limit = min(self.max_limit, max(self.min_limit, limit))
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+
+    class SimulatedBackend:
+        # capacity requests are served at base latency; above that latency
+        # grows with the load, and above 3x capacity requests fail
+        def __init__(self, base_latency=0.01):
+            self.base_latency = base_latency
+            self.capacity = 10
+            self.in_flight = 0
+
+        async def call(self):
+            self.in_flight += 1
+            try:
+                load = self.in_flight / self.capacity
+                if load > 3:
+                    await asyncio.sleep(self.base_latency)
+                    raise ConnectionError('overloaded')
+                await asyncio.sleep(self.base_latency * max(1.0, load) * random.uniform(0.8, 1.2))
+            finally:
+                self.in_flight -= 1
+
+    async def run(name, limiter, phases, clients):
+        backend = SimulatedBackend()
+        latencies, errors, limits = [], 0, []
+        stop = False
+
+        async def client():
+            nonlocal errors
+            while not stop:
+                start = time.perf_counter()
+                try:
+                    async with limiter:
+                        await backend.call()
+                    latencies.append(time.perf_counter() - start)
+                except ConnectionError:
+                    errors += 1
+
+        tasks = [asyncio.create_task(client()) for _ in range(clients)]
+        start = time.perf_counter()
+        for capacity, seconds in phases:
+            backend.capacity = capacity
+            phase_end = time.perf_counter() + seconds
+            while time.perf_counter() < phase_end:
+                await asyncio.sleep(0.1)
+                limits.append(getattr(limiter, 'limit', None))
+        stop = True
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+        shown = '' if limits[0] is None else ' limit {}..{}'.format(min(limits), max(limits))
+        print('{:>22}: {:7.0f} ok/s {:6.0f} errors/s  p99 {:6.1f} ms{}'.format(
+            name, len(latencies) / elapsed, errors / elapsed, p99 * 1000, shown))
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--phase', type=float, default=2.0, help='seconds per backend phase')
+    ns = parser.parse_args()
+    # backend capacity drops from 20 to 5, then goes up to 60
+    phases = [(20, ns.phase), (5, ns.phase), (60, ns.phase)]
+    print('backend capacity {} with {} clients'.format(' -> '.join(str(c) for c, _ in phases), ns.clients))
+
+    async def main():
+        await run('BoundedSemaphore(10)', asyncio.BoundedSemaphore(10), phases, ns.clients)
+        await run('BoundedSemaphore(60)', asyncio.BoundedSemaphore(60), phases, ns.clients)
+        await run('AdaptiveLimiter aimd', AdaptiveLimiter(10, algorithm='aimd', latency_threshold=0.02),
+                  phases, ns.clients)
+        await run('AdaptiveLimiter gradient', AdaptiveLimiter(10, algorithm='gradient'), phases, ns.clients)
+
+    asyncio.run(main())
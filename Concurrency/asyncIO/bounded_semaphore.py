@@ -1,5 +1,9 @@
 import asyncio
+import sys
 # Bounded semaphore is used to restrict N number of concurrent task/coroutines at a time
+# (python bounded_semaphore.py --adaptive: the limit adapts to latency/errors,
+# see adaptive_limiter.py)
+from adaptive_limiter import AdaptiveLimiter
 
 async def do_work(sem, n):
     async with sem:
@@ -7,14 +11,19 @@ async def do_work(sem, n):
         await asyncio.sleep(1)
         print("End of work for", n)
 
-async def main():
+async def main(adaptive=False):
     tasks = []
-    semaphore = asyncio.BoundedSemaphore(5)
+    if adaptive:
+        semaphore = AdaptiveLimiter(initial_limit=5)
+    else:
+        semaphore = asyncio.BoundedSemaphore(5)
     for i in range(10):
         tasks.append(asyncio.create_task(do_work(semaphore, i)))
     await asyncio.gather(*tasks)
+    if adaptive:
+        print("Limit is now", semaphore.limit, "p99 queue wait", round(semaphore.wait_percentile(99), 3))
 
 if __name__ =='__main__':
     loop = asyncio.get_event_loop()
     loop.set_debug(True)
-    loop.run_until_complete(main())
+    loop.run_until_complete(main('--adaptive' in sys.argv))
@@ -0,0 +1,203 @@
+# Persistent crawl state for incremental / resumable AsyncCrawler runs.
+#
+# pages    : what we know about every page ever fetched (validators for
+#            conditional requests, content hash, depth and its out links, so
+#            an unchanged page can still be expanded without downloading it)
+# frontier : every url queued by the current run, done=0 until it is handled.
+#            It is cleared when a crawl finishes, so a non-empty frontier on
+#            start-up means the last run crashed and can be resumed.
+#
+# The crawler calls the store from the event loop, so writes never touch
+# SQLite there: they collect in a batch, and every commit_every writes the
+# batch is written and committed by flush() in a worker thread, over its own
+# connection (WAL lets the loop keep reading meanwhile). Reads check the
+# batches not written yet first. The reads that are left on the loop are
+# primary key lookups, one or two per fetched page, tens of microseconds
+# each when the pages table is in the page cache.
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import time
+
+NOT_MODIFIED = object()    # returned by AsyncCrawler._http_request on a 304
+
+
+class _WriteBatch:
+
+    def __init__(self):
+        self.pages = {}      # url -> (etag, last_modified, content_hash, fetched_at)
+        self.links = {}      # url -> (depth, links)
+        self.queued = {}     # url -> depth
+        self.done = set()
+        self.clear_frontier = False
+        self.writes = 0
+
+
+class CrawlStateStore:
+
+    def __init__(self, path, commit_every=500):
+        self.path = path
+        self.conn = sqlite3.connect(path)    # reads, on the event loop
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS pages (
+                                 url TEXT PRIMARY KEY,
+                                 etag TEXT,
+                                 last_modified TEXT,
+                                 content_hash TEXT,
+                                 depth INTEGER,
+                                 links TEXT,
+                                 fetched_at REAL)''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS frontier (
+                                 url TEXT PRIMARY KEY,
+                                 depth INTEGER,
+                                 done INTEGER DEFAULT 0)''')
+        self.conn.commit()
+        self.commit_every = commit_every
+        self._pending = _WriteBatch()
+        self._flushing = None        # the batch a worker thread is writing
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._writer = None          # connection used by _write only
+
+    @staticmethod
+    def content_hash(body):
+        return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+    def _written(self):
+        self._pending.writes += 1
+        if self._pending.writes >= self.commit_every and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+            self._flush_task.add_done_callback(self._flush_done)
+
+    @staticmethod
+    def _flush_done(task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error('Writing crawl state failed: {}'.format(task.exception()))
+
+    async def flush(self):
+        """Write and commit everything recorded so far in a worker thread."""
+        # The lock keeps batches in order: a frontier delete must not overtake
+        # the inserts before it
+        async with self._flush_lock:
+            batch, self._pending = self._pending, _WriteBatch()
+            if not batch.writes and not batch.clear_frontier:
+                return
+            self._flushing = batch
+            try:
+                await asyncio.to_thread(self._write, batch)
+            finally:
+                self._flushing = None
+
+    def commit(self):
+        """flush() on the calling thread, for use outside the event loop."""
+        batch, self._pending = self._pending, _WriteBatch()
+        self._write(batch)
+
+    def close(self):
+        self.commit()
+        if self._writer is not None:
+            self._writer.close()
+        self.conn.close()
+
+    def _write(self, batch):
+        if self._writer is None:
+            self._writer = sqlite3.connect(self.path, check_same_thread=False)
+            self._writer.execute('PRAGMA synchronous=NORMAL')
+        with self._writer as conn:    # commits, or rolls back on an error
+            conn.executemany('''INSERT INTO pages (url, etag, last_modified, content_hash, fetched_at)
+                                VALUES (?, ?, ?, ?, ?)
+                                ON CONFLICT(url) DO UPDATE SET
+                                    etag = excluded.etag,
+                                    last_modified = excluded.last_modified,
+                                    content_hash = excluded.content_hash,
+                                    fetched_at = excluded.fetched_at''',
+                             [(url,) + page for url, page in batch.pages.items()])
+            conn.executemany('UPDATE pages SET depth = ?, links = ? WHERE url = ?',
+                             [(depth, links, url) for url, (depth, links) in batch.links.items()])
+            if batch.clear_frontier:
+                conn.execute('DELETE FROM frontier')
+            conn.executemany('INSERT OR IGNORE INTO frontier (url, depth) VALUES (?, ?)',
+                             batch.queued.items())
+            conn.executemany('UPDATE frontier SET done = 1 WHERE url = ?',
+                             [(url,) for url in batch.done])
+
+    def _unwritten(self, field, url):
+        # The newest value of url not committed yet, or None
+        for batch in (self._pending, self._flushing):
+            if batch is not None and url in getattr(batch, field):
+                return getattr(batch, field)[url]
+        return None
+
+    # -- pages ---------------------------------------------------------------
+
+    def conditional_headers(self, url):
+        page = self._unwritten('pages', url)
+        if page is not None:
+            row = page[:2]
+        else:
+            row = self.conn.execute('SELECT etag, last_modified FROM pages WHERE url = ?', (url,)).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers['If-None-Match'] = row[0]
+        if row and row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def is_unchanged(self, url, content_hash):
+        page = self._unwritten('pages', url)
+        if page is not None:
+            return page[2] == content_hash
+        row = self.conn.execute('SELECT content_hash FROM pages WHERE url = ?', (url,)).fetchone()
+        return row is not None and row[0] == content_hash
+
+    def record_response(self, url, etag, last_modified, content_hash):
+        self._pending.pages[url] = (etag, last_modified, content_hash, time.time())
+        self._written()
+
+    def record_links(self, url, depth, links):
+        self._pending.links[url] = (depth, '\n'.join(links))
+        self._written()
+
+    def has_links(self, url):
+        links = self._unwritten('links', url)
+        if links is not None:
+            return links[1] is not None
+        row = self.conn.execute('SELECT links IS NOT NULL FROM pages WHERE url = ?', (url,)).fetchone()
+        return bool(row and row[0])
+
+    def links(self, url):
+        links = self._unwritten('links', url)
+        row = links[1:] if links is not None else \
+            self.conn.execute('SELECT links FROM pages WHERE url = ?', (url,)).fetchone()
+        return row[0].split('\n') if row and row[0] else []
+
+    # -- frontier ------------------------------------------------------------
+
+    def add_to_frontier(self, url, depth):
+        self._pending.queued.setdefault(url, depth)
+        self._written()
+
+    def mark_done(self, url):
+        self._pending.done.add(url)
+        self._written()
+
+    def saved_frontier(self):
+        """Return (queued urls, [(depth, url) still to do]) left by an unfinished run.
+
+        Called on start-up, before anything is recorded."""
+        queued, todo = [], []
+        for url, depth, done in self.conn.execute('SELECT url, depth, done FROM frontier'):
+            queued.append(url)
+            if not done:
+                todo.append((depth, url))
+        return queued, todo
+
+    def clear_frontier(self):
+        # Written by the next flush(), after the batch still being written
+        batch = self._pending
+        batch.queued.clear()
+        batch.done.clear()
+        batch.clear_frontier = True
@@ -0,0 +1,135 @@
+# Instrumentation for AsyncCrawler.
+#
+# Per-phase latency histograms (queue wait, semaphore wait, connect, TTFB,
+# body read, parse), in-flight requests, bytes downloaded and errors by type.
+# Histograms use fixed exponential buckets, so observe() is a bisect plus two
+# additions and memory does not grow with the number of requests.
+#
+#   crawler.metrics.snapshot()           -> plain dict
+#   crawler.metrics.prometheus_text()    -> Prometheus text exposition format
+#   await serve_metrics(crawler.metrics, port=9100)   -> GET /metrics
+
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from aiohttp import TraceConfig, web
+
+PHASES = ('queue_wait', 'semaphore_wait', 'connect', 'ttfb', 'body_read', 'parse')
+
+# 100us .. ~105s, doubling
+BUCKETS = tuple(0.0001 * 2 ** i for i in range(21))
+
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)    # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-th value, like
+        # Prometheus' histogram_quantile without the interpolation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+        }
+
+
+class CrawlerMetrics:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.in_flight = 0
+        self.requests = 0
+        self.bytes = 0
+        self.errors = Counter()
+
+    def observe(self, phase, seconds):
+        self.phases[phase].observe(seconds)
+
+    def error(self, exc):
+        self.errors[type(exc).__name__] += 1
+
+    def trace_config(self):
+        # aiohttp only reports connection set-up through tracing hooks
+        async def on_start(session, ctx, params):
+            ctx.connect_started = time.perf_counter()
+
+        async def on_end(session, ctx, params):
+            self.observe('connect', time.perf_counter() - ctx.connect_started)
+
+        trace_config = TraceConfig()
+        trace_config.on_connection_create_start.append(on_start)
+        trace_config.on_connection_create_end.append(on_end)
+        return trace_config
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'elapsed': elapsed,
+            'requests': self.requests,
+            'in_flight': self.in_flight,
+            'bytes': self.bytes,
+            'bytes_per_sec': self.bytes / elapsed if elapsed else 0.0,
+            'errors': dict(self.errors),
+            'phases': {phase: hist.summary() for phase, hist in self.phases.items()},
+        }
+
+    def prometheus_text(self):
+        lines = [
+            '# TYPE crawler_requests_total counter',
+            'crawler_requests_total {}'.format(self.requests),
+            '# TYPE crawler_in_flight gauge',
+            'crawler_in_flight {}'.format(self.in_flight),
+            '# TYPE crawler_bytes_total counter',
+            'crawler_bytes_total {}'.format(self.bytes),
+            '# TYPE crawler_errors_total counter',
+        ]
+        for error_type, count in sorted(self.errors.items()):
+            lines.append('crawler_errors_total{{type="{}"}} {}'.format(error_type, count))
+        lines.append('# TYPE crawler_phase_seconds histogram')
+        for phase, hist in self.phases.items():
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                lines.append('crawler_phase_seconds_bucket{{phase="{}",le="{:g}"}} {}'.format(
+                    phase, bound, cumulative))
+            lines.append('crawler_phase_seconds_bucket{{phase="{}",le="+Inf"}} {}'.format(phase, hist.count))
+            lines.append('crawler_phase_seconds_sum{{phase="{}"}} {}'.format(phase, hist.sum))
+            lines.append('crawler_phase_seconds_count{{phase="{}"}} {}'.format(phase, hist.count))
+        return '\n'.join(lines) + '\n'
+
+
+async def serve_metrics(metrics, host='127.0.0.1', port=9100):
+    async def handler(request):
+        return web.Response(text=metrics.prometheus_text(), content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
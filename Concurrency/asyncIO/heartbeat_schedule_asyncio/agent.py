@@ -1,11 +1,31 @@
 import asyncio
 import argparse
+import os
 import shlex
+import signal
+import socket
 from enum import Enum
-from typing import List
+from typing import Dict, List, Optional, Set
+from urllib.parse import urlencode
 
 import aiohttp
 
+from heartbeat_scheduler import HeartbeatScheduler
+from job_output import JobOutput, pump
+
+try:
+    import resource
+except ImportError:
+    # Windows: jobs run, but without limits and without a process group
+    resource = None
+
+# run(limits={...}) keys -> setrlimit resources, applied in the child
+RLIMITS = {
+    "cpu": resource.RLIMIT_CPU,        # seconds of CPU time
+    "memory": resource.RLIMIT_AS,      # bytes of address space
+    "files": resource.RLIMIT_NOFILE,   # open file descriptors
+} if resource is not None else {}
+
 
 class JobStatus(Enum):
     STARTED = "started"
@@ -13,45 +33,188 @@ class JobStatus(Enum):
     FAILED = "failed"
 
 
-async def run(command: List[str]) -> JobStatus:
-    #process = await asyncio.create_subprocess_exec(*command)
-    #await process.wait()
-    result = await asyncio.sleep(3)
-    print("sleep result {}".format(result))
-    # if process.returncode == 0:
-    #     return JobStatus.COMPLETED
-    # else:
-    #     return JobStatus.FAILED
+def _set_limits(limits: Dict[str, int]):
+    def preexec():
+        for name, value in limits.items():
+            resource.setrlimit(RLIMITS[name], (value, value))
+    return preexec
+
+
+class _ExitProtocol(asyncio.subprocess.SubprocessStreamProtocol):
+    # process.wait() only returns once the pipes are closed too, which a
+    # background child of the job can put off forever; `exited` is set as
+    # soon as the job's own process exits
+    def __init__(self, limit: int, loop: asyncio.AbstractEventLoop):
+        super().__init__(limit=limit, loop=loop)
+        self.exited = loop.create_future()
+
+    def process_exited(self) -> None:
+        super().process_exited()
+        if not self.exited.done():
+            self.exited.set_result(None)
 
 
-async def send_status(url: str, status: JobStatus) -> None:
+def _kill_group(process: asyncio.subprocess.Process) -> None:
+    try:
+        if hasattr(os, "killpg"):
+            # The group outlives its leader while any child is left in it
+            os.killpg(process.pid, signal.SIGKILL)
+        elif process.returncode is None:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def run(command: List[str], timeout: Optional[float] = None,
+              limits: Optional[Dict[str, int]] = None,
+              output: Optional[JobOutput] = None, drain_timeout: float = 5.0) -> JobStatus:
+    """Run command, streaming stdout/stderr into output (bounded tails by default).
+
+    The job gets its own process group, which is killed on timeout or when
+    the agent cancels the job (on Windows only the process itself is killed),
+    even if the job's own process already exited. Once it exits, the pipes
+    get drain_timeout seconds to reach EOF; children still holding them open
+    after that are killed with the group.
+    """
+    if limits and resource is None:
+        raise ValueError("job limits need the resource module (POSIX)")
+    output = output or JobOutput()
+    loop = asyncio.get_running_loop()
+    # asyncio.create_subprocess_exec(), with a protocol that reports the exit
+    transport, protocol = await loop.subprocess_exec(
+        lambda: _ExitProtocol(1 << 20, loop),
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+        preexec_fn=_set_limits(limits) if limits else None,
+    )
+    process = asyncio.subprocess.Process(transport, protocol, loop)
+    pumps = asyncio.gather(pump(process.stdout, output.sinks["stdout"]),
+                           pump(process.stderr, output.sinks["stderr"]))
+    clean = False
+    try:
+        try:
+            await asyncio.wait_for(asyncio.shield(protocol.exited), timeout)
+        except asyncio.TimeoutError:
+            print(f"{command[0]} timed out after {timeout} s")
+            return JobStatus.FAILED
+        done, _ = await asyncio.wait({pumps}, timeout=drain_timeout)
+        if done:
+            pumps.result()
+            clean = True
+        else:
+            print(f"{command[0]} exited, but its pipes are still open after {drain_timeout} s")
+    finally:
+        if not clean:
+            # Timeout, cancellation or children left behind
+            _kill_group(process)
+            await asyncio.shield(protocol.exited)
+            # Whatever is still buffered in the pipes, unless a process that
+            # left the group keeps them open
+            await asyncio.wait({pumps}, timeout=1.0)
+            pumps.cancel()
+            await asyncio.gather(pumps, return_exceptions=True)
+        transport.close()
+        output.close()
+    if process.returncode == 0:
+        return JobStatus.COMPLETED
+    else:
+        return JobStatus.FAILED
+
+
+async def send_status(url: str, status: JobStatus,
+                      session: Optional[aiohttp.ClientSession] = None,
+                      job_id: Optional[str] = None) -> None:
     payload = {"status": status.value}
+    if job_id is not None:
+        payload["job"] = job_id
+    if session is not None:
+        async with session.put(url, json=payload):
+            pass
+        return
     async with aiohttp.ClientSession() as session:
         await session.put(url, json=payload)
 
 
-async def heartbeat(url: str, period: float) -> None:
+async def put_output(session: aiohttp.ClientSession, url: str, outputs: Dict[str, JobOutput],
+                     final: bool = False) -> None:
+    """PUT the new output of every job in outputs to url in one request.
+
+    Output only counts as sent once the server took it; after a failure it
+    goes out again with the next call. final=True for jobs that are done.
+    """
+    chunks, taken = [], []
+    for job_id, output in outputs.items():
+        new, offsets = output.new_output(final)
+        for stream, text in new.items():
+            chunks.append({"job": job_id, "stream": stream, "data": text})
+        taken.append((output, offsets))
+    if not chunks:
+        return
+    try:
+        async with session.put(url, json=chunks) as response:
+            response.raise_for_status()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"output of {len(taken)} jobs not sent: {e!r}")
+        return
+    for output, offsets in taken:
+        output.mark_sent(offsets)
+
+
+async def heartbeat(url: str, period: float, jitter: float = 0.1) -> None:
     async with aiohttp.ClientSession() as session:
         print("heartbeat method url period", url, period)
-        while True:
-            await session.put(url)
-            await asyncio.sleep(period)
+
+        async def send():
+            async with session.put(url) as response:
+                return response.status, response.headers
+
+        await HeartbeatScheduler(period, jitter).run(send)
 
 
-async def main(command: List[str], tracking_server_url: str, heartbeat_period: float) -> None:
+async def main(command: List[str], tracking_server_url: str, heartbeat_period: float,
+               heartbeat_jitter: float = 0.1, timeout: Optional[float] = None,
+               limits: Optional[Dict[str, int]] = None, log_dir: Optional[str] = None,
+               job_id: Optional[str] = None, send_output: bool = False) -> None:
+    # Without an id every single-job agent would be the same job to the server
+    job_id = job_id or f"{socket.gethostname()}-{os.getpid()}"
     status_url = f"{tracking_server_url}/status"
-    heartbeat_url = f"{tracking_server_url}/heartbeat"
+    heartbeat_url = f"{tracking_server_url}/heartbeat?{urlencode({'job': job_id})}"
+    outputs_url = f"{tracking_server_url}/outputs"
 
     print("Print command ", command)
-    await send_status(status_url, JobStatus.STARTED)
+    await send_status(status_url, JobStatus.STARTED, job_id=job_id)
 
     # Use asyncio.create_task to start running the heartbeat coroutine
     # immediately
-    heartbeat_future = asyncio.create_task(heartbeat(heartbeat_url, heartbeat_period))
+    heartbeat_future = asyncio.create_task(heartbeat(heartbeat_url, heartbeat_period, heartbeat_jitter))
     #
     # # Run command
-    final_status = await run(command)
-    await send_status(status_url, final_status)
+    output = JobOutput(job_id, log_dir=log_dir)
+    async with aiohttp.ClientSession() as session:
+
+        async def output_loop():
+            while True:
+                await asyncio.sleep(heartbeat_period)
+                await put_output(session, outputs_url, {job_id: output})
+
+        output_future = asyncio.create_task(output_loop()) if send_output else None
+        try:
+            final_status = await run(command, timeout, limits, output)
+        finally:
+            if output_future is not None:
+                output_future.cancel()
+                try:
+                    await output_future
+                except asyncio.CancelledError:
+                    pass
+        if send_output:
+            await put_output(session, outputs_url, {job_id: output}, final=True)
+    if final_status is JobStatus.FAILED:
+        print(output.stderr.tail().decode("utf-8", "replace"), end="")
+    await send_status(status_url, final_status, job_id=job_id)
     #
     # # Cancel heartbeat future (as it is on an infinite loop) and wait for it to
     # # finish
@@ -62,9 +225,114 @@ async def main(command: List[str], tracking_server_url: str, heartbeat_period: f
          pass
 
 
+class Multiplexer:
+    """Runs many jobs from one event loop.
+
+    All jobs share one pooled session; instead of one heartbeat request per
+    job, the ids of every live job go out in one PUT {"jobs": [...]} to the
+    /heartbeats endpoint each period. With send_output the new output of
+    every job goes out the same way, in one PUT /outputs per period, from
+    its own task so a slow upload can't delay or back off the heartbeats.
+    """
+
+    def __init__(self, tracking_server_url: str, heartbeat_period: float,
+                 max_jobs: int = 1000, max_connections: int = 8, heartbeat_jitter: float = 0.1,
+                 timeout: Optional[float] = None, limits: Optional[Dict[str, int]] = None,
+                 log_dir: Optional[str] = None, send_output: bool = False):
+        self.status_url = f"{tracking_server_url}/status"
+        self.heartbeats_url = f"{tracking_server_url}/heartbeats"
+        self.outputs_url = f"{tracking_server_url}/outputs"
+        self.timeout = timeout
+        self.limits = limits
+        self.log_dir = log_dir
+        self.send_output = send_output
+        self.outputs: Dict[str, JobOutput] = {}
+        self.output_lock = asyncio.Lock()
+        self.scheduler = HeartbeatScheduler(heartbeat_period, heartbeat_jitter)
+        self.max_connections = max_connections
+        self.job_slots = asyncio.Semaphore(max_jobs)
+        self.live: Set[str] = set()
+        self.results: Dict[str, JobStatus] = {}
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def heartbeat(self) -> None:
+        async def send():
+            if not self.live:
+                return 200, {}
+            async with self.session.put(self.heartbeats_url, json={"jobs": sorted(self.live)}) as response:
+                return response.status, response.headers
+
+        await self.scheduler.run(send)
+
+    async def output_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.scheduler.base_period)
+            await self.flush_output(dict(self.outputs))
+
+    async def flush_output(self, outputs: Dict[str, JobOutput], final: bool = False) -> None:
+        # The lock keeps the loop and a finishing job from sending the same bytes
+        async with self.output_lock:
+            await put_output(self.session, self.outputs_url, outputs, final)
+
+    async def send_status(self, job_id: str, status: JobStatus) -> None:
+        # A lost status update is only logged, it must not stop the other jobs
+        try:
+            await send_status(self.status_url, status, self.session, job_id)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"status {status.value} of {job_id} not sent: {e!r}")
+
+    async def run_job(self, job_id: str, command: List[str]) -> JobStatus:
+        async with self.job_slots:
+            await self.send_status(job_id, JobStatus.STARTED)
+            self.live.add(job_id)
+            output = None
+            try:
+                output = self.outputs[job_id] = JobOutput(job_id, log_dir=self.log_dir)
+                final_status = await run(command, self.timeout, self.limits, output)
+            except Exception as e:
+                # A missing executable, a limit the child can't set (SubprocessError) ...
+                print(f"{job_id} could not run: {e!r}")
+                final_status = JobStatus.FAILED
+            finally:
+                self.live.discard(job_id)
+                self.outputs.pop(job_id, None)
+            if self.send_output and output is not None:
+                await self.flush_output({job_id: output}, final=True)
+            await self.send_status(job_id, final_status)
+            self.results[job_id] = final_status
+            return final_status
+
+    async def run_all(self, jobs: Dict[str, List[str]]) -> Dict[str, JobStatus]:
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        async with aiohttp.ClientSession(connector=connector) as self.session:
+            background = [asyncio.create_task(self.heartbeat())]
+            if self.send_output:
+                background.append(asyncio.create_task(self.output_loop()))
+            try:
+                await asyncio.gather(*(self.run_job(job_id, command) for job_id, command in jobs.items()))
+            finally:
+                for task in background:
+                    task.cancel()
+                await asyncio.gather(*background, return_exceptions=True)
+        return self.results
+
+
+def read_jobs(path: str) -> Dict[str, List[str]]:
+    """One job per line: "<job id> <command ...>"; blank lines and # comments are skipped."""
+    jobs = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                job_id, command = line.split(None, 1)
+                jobs[job_id] = shlex.split(command)
+    return jobs
+
+
 def cli():
     parser = argparse.ArgumentParser()
-    parser.add_argument("command", help="The job command to run")
+    parser.add_argument("command", nargs="?",
+                        help="The job command to run (or use --jobs-file)")
     parser.add_argument("tracking_url", help="The URL of the tracking server")
     parser.add_argument(
         "--heartbeat-period",
@@ -73,16 +341,56 @@ def cli():
         help="The period on which to send heartbeats to the tracking server "
         "(in seconds)",
     )
+    parser.add_argument(
+        "--heartbeat-jitter",
+        type=float,
+        default=0.1,
+        help="Move every heartbeat randomly by up to this fraction of the period",
+    )
+    parser.add_argument(
+        "--jobs-file",
+        help="Run every job in this file (\"<job id> <command>\" per line) "
+        "from one agent, with one batched heartbeat per period",
+    )
+    parser.add_argument("--max-jobs", type=int, default=1000,
+                        help="How many jobs of --jobs-file run at the same time")
+    parser.add_argument("--timeout", type=float, help="Kill a job after this many seconds")
+    parser.add_argument("--max-cpu", type=int, help="CPU seconds limit per job")
+    parser.add_argument("--max-memory", type=int, help="Address space limit per job, in MB")
+    parser.add_argument("--job-id", help="The id the tracking server knows the job by "
+                        "(default <host>-<pid>; --jobs-file gives every job its own)")
+    parser.add_argument("--log-dir", help="Also write job output to rotating files here")
+    parser.add_argument("--send-output", action="store_true",
+                        help="Send new job output to the tracking server every heartbeat period")
     args = parser.parse_args()
 
+    limits = {}
+    if args.max_cpu:
+        limits["cpu"] = args.max_cpu
+    if args.max_memory:
+        limits["memory"] = args.max_memory * 1024 * 1024
+    if limits and resource is None:
+        parser.error("--max-cpu and --max-memory need a POSIX system")
+
+    if args.jobs_file:
+        multiplexer = Multiplexer(args.tracking_url, args.heartbeat_period, args.max_jobs,
+                                  heartbeat_jitter=args.heartbeat_jitter, timeout=args.timeout,
+                                  limits=limits, log_dir=args.log_dir, send_output=args.send_output)
+        results = asyncio.run(multiplexer.run_all(read_jobs(args.jobs_file)))
+        failed = [job_id for job_id, status in results.items() if status is JobStatus.FAILED]
+        print(f"{len(results)} jobs, {len(failed)} failed {failed[:10]}, "
+              f"{multiplexer.scheduler.failures} failed heartbeats")
+        return
+    if args.command is None:
+        parser.error("a command or --jobs-file is required")
+
     command_parts = shlex.split(args.command)
 
-    #loop = asyncio.get_event_loop()  this is for linux
-    loop = asyncio.ProactorEventLoop() # this is specifically for windows
-    asyncio.set_event_loop(loop)
-    results = loop.run_until_complete(main(command_parts, args.tracking_url, args.heartbeat_period))
-    loop.close()
-    #asyncio.run(main(command_parts, args.tracking_url, args.heartbeat_period))
+    # The default loop runs subprocesses on Linux and (since 3.8) on Windows;
+    # job limits and process-group kills are POSIX only
+    asyncio.run(main(command_parts, args.tracking_url, args.heartbeat_period,
+                     args.heartbeat_jitter, args.timeout, limits, args.log_dir, args.job_id,
+                     args.send_output))
 
 
 if __name__ == "__main__":
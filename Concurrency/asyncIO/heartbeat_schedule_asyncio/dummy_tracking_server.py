@@ -8,7 +8,7 @@ def status():
     print("request.method", request.method)
     body = request.get_json(force=True)
     if request.method == 'PUT':
-        print(f"Received status {body['status']}")
+        print(f"Received status {body['status']} for job {body.get('job')}")
         return '', 200
 
 
@@ -18,5 +18,21 @@ def heartbeat():
     return "", 200
 
 
+@app.route("/heartbeats", methods=["PUT"])
+def heartbeats():
+    # One request for all the live jobs of a multiplexing agent
+    body = request.get_json(force=True)
+    print(f"Received heartbeats for {len(body['jobs'])} jobs")
+    return "", 200
+
+
+@app.route("/outputs", methods=["PUT"])
+def outputs():
+    # Batched output tails: [{"job": ..., "stream": ..., "data": ...}, ...]
+    for chunk in request.get_json(force=True):
+        print(f"Received {len(chunk['data'])} characters of {chunk['stream']} from job {chunk['job']}")
+    return "", 200
+
+
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,100 @@
+"""
+Drift-free, jittered heartbeats with an adaptive period.
+
+`await session.put(url); await asyncio.sleep(period)` drifts by the request
+latency every beat, and agents started together beat in lockstep. Here beats
+are scheduled on absolute deadlines of the loop clock (start + n * period), so
+latency does not accumulate, and every beat is moved by a random offset of up
+to +-jitter * period around its deadline. With jitter the first beat is also
+placed at a random point of the first period, which spreads a fleet started at
+the same moment over the whole period.
+
+The server can ask for fewer beats: a 429/503 response, a Retry-After header
+or an X-Heartbeat-Backoff header multiplies the period by `backoff` (at least
+up to Retry-After seconds, at most max_period). Failed beats (exceptions,
+timeouts) back off the same way and are counted. Every normal response lets
+the period recover towards the configured one.
+
+Only one beat is in flight at a time and a beat times out after one period; if
+a beat still overran deadlines they are skipped (counted in `skipped`) instead
+of being sent back to back.
+"""
+
+import asyncio
+import random
+from typing import Awaitable, Callable, Mapping, Optional, Tuple
+
+LOAD_STATUSES = (429, 503)
+BACKOFF_HEADER = "X-Heartbeat-Backoff"
+
+# send() returns the response status and headers
+Send = Callable[[], Awaitable[Tuple[int, Mapping[str, str]]]]
+
+
+class HeartbeatScheduler:
+
+    def __init__(self, period: float, jitter: float = 0.1, max_period: Optional[float] = None,
+                 backoff: float = 2.0, recovery: float = 0.8,
+                 clock: Optional[Callable[[], float]] = None,
+                 sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+                 rand: Callable[[], float] = random.random):
+        self.base_period = self.period = period
+        self.jitter = jitter
+        self.max_period = max_period or period * 16
+        self.backoff = backoff
+        self.recovery = recovery
+        self._clock = clock
+        self._sleep = sleep
+        self._rand = rand
+        self.sent = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.skipped = 0
+        self.load_signals = 0
+
+    def on_response(self, status: int, headers: Mapping[str, str]) -> None:
+        self.sent += 1
+        self.consecutive_failures = 0
+        retry_after = headers.get("Retry-After")
+        if status in LOAD_STATUSES or retry_after is not None or headers.get(BACKOFF_HEADER):
+            self.load_signals += 1
+            period = self.period * self.backoff
+            try:
+                period = max(period, float(retry_after))
+            except (TypeError, ValueError):
+                pass
+            self.period = min(period, self.max_period)
+        else:
+            self.period = max(self.base_period, self.period * self.recovery)
+
+    def on_failure(self) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.period = min(self.period * self.backoff, self.max_period)
+
+    def _offset(self) -> float:
+        return (self._rand() * 2 - 1) * self.jitter * self.period
+
+    async def run(self, send: Send, count: Optional[int] = None) -> None:
+        """Call send() on every deadline, forever or for count beats."""
+        clock = self._clock or asyncio.get_running_loop().time
+        deadline = clock() + (self._rand() * self.period if self.jitter else 0.0)
+        beats = 0
+        while count is None or beats < count:
+            delay = deadline + self._offset() - clock()
+            if delay > 0:
+                await self._sleep(delay)
+            try:
+                status, headers = await asyncio.wait_for(send(), self.period)
+            except Exception:
+                self.on_failure()
+            else:
+                self.on_response(status, headers)
+            beats += 1
+
+            deadline += self.period
+            now = clock()
+            if deadline < now:
+                missed = int((now - deadline) // self.period) + 1
+                self.skipped += missed
+                deadline += missed * self.period
@@ -0,0 +1,155 @@
+"""
+Output capture for the jobs the agent runs.
+
+A job can print gigabytes, so nothing here keeps its whole output. The
+agent reads the stdout/stderr pipes in big chunks and writes every chunk to
+the sinks of that stream:
+
+- OutputTail keeps only the last `limit` bytes in memory, and new_data()
+  returns what arrived since the last mark_sent(), to send to the tracking
+  server; the offset is only committed once the send worked
+- RotatingFile writes to <log_dir>/<job>.<stream>.log and rotates it to .1,
+  .2 ... when it reaches max_bytes, so the disk usage is bounded as well.
+  Its writes block, so pump() runs them in a thread (sinks with
+  blocking = True), not on the event loop
+- JobOutput.new_output() decodes each stream with its own incremental UTF-8
+  decoder, so a character split between two sends is not mangled
+"""
+
+import asyncio
+import codecs
+import os
+from typing import Dict, List, Optional, Tuple
+
+CHUNK_SIZE = 1 << 18
+
+
+class OutputTail:
+
+    blocking = False
+
+    def __init__(self, limit: int = 64 * 1024):
+        self.limit = limit
+        self.buffer = bytearray()
+        self.total = 0
+        self.sent = 0
+
+    def write(self, chunk: bytes) -> None:
+        self.total += len(chunk)
+        if len(chunk) >= self.limit:
+            self.buffer[:] = chunk[-self.limit:]
+            return
+        self.buffer += chunk
+        if len(self.buffer) > self.limit:
+            # bytearray deletes from the front without moving the rest
+            del self.buffer[:len(self.buffer) - self.limit]
+
+    def tail(self) -> bytes:
+        return bytes(self.buffer)
+
+    def new_data(self) -> Tuple[bytes, int]:
+        """Bytes not sent yet (at most the last `limit`) and the offset to
+        pass to mark_sent() once they are."""
+        new = min(self.total - self.sent, len(self.buffer))
+        return (bytes(self.buffer[len(self.buffer) - new:]) if new else b""), self.total
+
+    def mark_sent(self, offset: int) -> None:
+        self.sent = max(self.sent, offset)
+
+    def close(self) -> None:
+        pass
+
+
+class RotatingFile:
+
+    blocking = True
+
+    def __init__(self, path: str, max_bytes: int = 100 * 1024 * 1024, backups: int = 2):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = open(path, "wb")
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        if self.size + len(chunk) > self.max_bytes and self.size:
+            self._rotate()
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def _rotate(self) -> None:
+        self.file.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, "wb")
+        self.size = 0
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class JobOutput:
+    """The sinks for the stdout and stderr of one job."""
+
+    def __init__(self, job_id: str = "job", tail_bytes: int = 64 * 1024,
+                 log_dir: Optional[str] = None, max_file_bytes: int = 100 * 1024 * 1024):
+        self.stdout = OutputTail(tail_bytes)
+        self.stderr = OutputTail(tail_bytes)
+        self.sinks = {"stdout": [self.stdout], "stderr": [self.stderr]}
+        self._decoders = {name: codecs.getincrementaldecoder("utf-8")("replace") for name in self.sinks}
+        # Decoder state as of the last mark_sent(): a failed send decodes the
+        # same bytes again from there
+        self._sent_states = {name: decoder.getstate() for name, decoder in self._decoders.items()}
+        if log_dir is not None:
+            os.makedirs(log_dir, exist_ok=True)
+            for name, sinks in self.sinks.items():
+                sinks.append(RotatingFile(os.path.join(log_dir, f"{job_id}.{name}.log"), max_file_bytes))
+
+    def new_output(self, final: bool = False) -> Tuple[Dict[str, str], Dict[str, Tuple[int, tuple]]]:
+        """({"stdout": text, "stderr": text} not sent yet, offsets for mark_sent()).
+
+        A character cut off at the end is held back for the next call;
+        final=True (the job is done) turns it into U+FFFD instead.
+        """
+        new, offsets = {}, {}
+        for name, tail in (("stdout", self.stdout), ("stderr", self.stderr)):
+            data, offset = tail.new_data()
+            decoder = self._decoders[name]
+            if len(data) < offset - tail.sent:
+                # The tail dropped unsent bytes, what is left is not a continuation
+                decoder.reset()
+            else:
+                decoder.setstate(self._sent_states[name])
+            text = decoder.decode(data, final)
+            if text:
+                new[name] = text
+            offsets[name] = (offset, decoder.getstate())
+        return new, offsets
+
+    def mark_sent(self, offsets: Dict[str, Tuple[int, tuple]]) -> None:
+        for name, tail in (("stdout", self.stdout), ("stderr", self.stderr)):
+            offset, self._sent_states[name] = offsets[name]
+            tail.mark_sent(offset)
+
+    def close(self) -> None:
+        for sinks in self.sinks.values():
+            for sink in sinks:
+                sink.close()
+
+
+async def pump(stream: asyncio.StreamReader, sinks: List) -> None:
+    """Copy a subprocess pipe into sinks until EOF."""
+    read = stream.read
+    while True:
+        chunk = await read(CHUNK_SIZE)
+        if not chunk:
+            return
+        for sink in sinks:
+            if sink.blocking:
+                # Disk writes (and rotations) off the event loop
+                await asyncio.to_thread(sink.write, chunk)
+            else:
+                sink.write(chunk)
@@ -0,0 +1,93 @@
+import asyncio
+import random
+import unittest
+
+from heartbeat_scheduler import HeartbeatScheduler
+
+
+class FakeClock:
+    # time() only moves when the scheduler sleeps or a fake request takes time
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.now += delay
+
+
+def fake_server(clock, beats, latency=0.0, responses=None):
+    """send() for the scheduler: records the time of every beat."""
+    async def send():
+        beats.append(clock.now)
+        clock.now += latency
+        response = responses.pop(0) if responses else (200, {})
+        if isinstance(response, Exception):
+            raise response
+        return response
+    return send
+
+
+class TestHeartbeatScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.beats = []
+
+    def scheduler(self, period=1.0, jitter=0.0, **kwargs):
+        return HeartbeatScheduler(period, jitter=jitter, clock=self.clock.time, sleep=self.clock.sleep, **kwargs)
+
+    def run_beats(self, scheduler, count, **kwargs):
+        asyncio.run(scheduler.run(fake_server(self.clock, self.beats, **kwargs), count=count))
+
+    def test_latency_does_not_drift(self):
+        self.run_beats(self.scheduler(), 5, latency=0.3)
+        self.assertEqual(self.beats, [0.0, 1.0, 2.0, 3.0, 4.0])
+
+    def test_jitter_stays_around_deadlines(self):
+        scheduler = self.scheduler(jitter=0.1, rand=random.Random(1).random)
+        self.run_beats(scheduler, 20, latency=0.05)
+        phase = self.beats[0]
+        self.assertTrue(0 <= phase < 1.1)
+        for n, beat in enumerate(self.beats[1:], 1):
+            self.assertAlmostEqual(beat, phase + n, delta=0.2 + 1e-9)
+
+    def test_jitter_spreads_agents_started_together(self):
+        first_beats = []
+        for seed in range(20):
+            self.clock.now = 0.0
+            self.beats = []
+            self.run_beats(self.scheduler(jitter=0.1, rand=random.Random(seed).random), 1)
+            first_beats.append(self.beats[0])
+        self.assertGreater(max(first_beats) - min(first_beats), 0.5)
+
+    def test_slow_beats_skip_missed_deadlines(self):
+        scheduler = self.scheduler()
+        self.run_beats(scheduler, 3, latency=2.5)
+        # 0 -> done at 2.5, deadlines 1 and 2 skipped, next one at 3; then 4, 5 and 7, 8
+        self.assertEqual(self.beats, [0.0, 3.0, 6.0])
+        self.assertEqual(scheduler.skipped, 6)
+
+    def test_backoff_on_load_and_recovery(self):
+        scheduler = self.scheduler(backoff=2.0, recovery=0.5, max_period=8.0)
+        responses = [(503, {}), (200, {"Retry-After": "6"}), (200, {"X-Heartbeat-Backoff": "1"}), (200, {}), (200, {}),
+                     (200, {}), (200, {})]
+        self.run_beats(scheduler, 7, responses=responses)
+        # 503: 2, Retry-After: 6, header: 12 capped at 8, then halving back to 1
+        self.assertEqual(self.beats, [0.0, 2.0, 8.0, 16.0, 20.0, 22.0, 23.0])
+        self.assertEqual(scheduler.load_signals, 3)
+        self.assertEqual(scheduler.period, 1.0)
+
+    def test_failures_are_counted_and_back_off(self):
+        scheduler = self.scheduler(backoff=2.0, recovery=0.5)
+        responses = [OSError("refused"), OSError("refused"), (200, {})]
+        self.run_beats(scheduler, 3, responses=responses)
+        self.assertEqual(self.beats, [0.0, 2.0, 6.0])
+        self.assertEqual(scheduler.failures, 2)
+        self.assertEqual(scheduler.consecutive_failures, 0)
+        self.assertEqual(scheduler.sent, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from tracking_server import DEAD, FINISHED, LIVE, JobTable, make_app
+
+
+class TestJobTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = JobTable(timeout=1.0, tick=0.1)
+
+    def states(self):
+        return {job_id: job.state for job_id, job in self.table.jobs.items()}
+
+    def test_overdue_jobs_expire(self):
+        self.table.heartbeat("a", 0.0)
+        self.table.heartbeat("b", 0.0)
+        self.table.expire(0.5)
+        self.table.heartbeat("b", 0.5)
+        self.assertEqual(self.table.expire(1.2), 1)
+        self.assertEqual(self.states(), {"a": DEAD, "b": LIVE})
+        self.table.expire(1.6)
+        self.assertEqual(self.states(), {"a": DEAD, "b": DEAD})
+        self.assertEqual(self.table.expired, 2)
+
+    def test_heartbeat_revives_dead_job(self):
+        self.table.heartbeat("a", 0.0)
+        self.table.expire(2.0)
+        self.table.heartbeat("a", 2.5)
+        self.assertEqual(self.states(), {"a": LIVE})
+        self.table.expire(3.0)
+        self.assertEqual(self.states(), {"a": LIVE})
+        self.table.expire(3.6)
+        self.assertEqual(self.states(), {"a": DEAD})
+
+    def test_final_status_stops_expiry(self):
+        self.table.set_status("a", "started", 0.0)
+        self.table.set_status("a", "completed", 0.5)
+        self.table.expire(5.0)
+        self.assertEqual(self.states(), {"a": FINISHED})
+
+    def test_deadlines_beyond_one_wheel_turn(self):
+        table = JobTable(timeout=500.0, tick=0.1)
+        table.heartbeat("a", 0.0)
+        for now in range(0, 500, 10):
+            table.expire(float(now))
+        self.assertEqual(table.jobs["a"].state, LIVE)
+        table.expire(500.1)
+        self.assertEqual(table.jobs["a"].state, DEAD)
+
+    def test_terminal_jobs_are_removed_after_retention(self):
+        table = JobTable(timeout=1.0, tick=0.1, retention=10.0)
+        table.heartbeat("dead", 0.0)
+        table.set_status("done", "completed", 0.0)
+        table.expire(1.2)
+        self.assertEqual(table.jobs["dead"].state, DEAD)
+        table.expire(10.5)
+        self.assertEqual(set(table.jobs), {"dead"})
+        table.expire(11.3)
+        self.assertEqual(table.jobs, {})
+        self.assertEqual(table.removed, 2)
+
+    def test_revived_job_leaves_its_removal_bucket(self):
+        table = JobTable(timeout=1.0, tick=0.1, retention=60.0)
+        table.heartbeat("a", 0.0)
+        table.expire(1.2)
+        table.heartbeat("a", 2.0)
+        table.expire(3.1)
+        self.assertEqual(table.jobs["a"].state, DEAD)
+
+    def test_job_seen_only_through_output_expires(self):
+        self.table.add_output("a", "stdout", "hello", 0.0)
+        self.table.expire(1.2)
+        self.assertEqual(self.states(), {"a": DEAD})
+
+    def test_query_by_state(self):
+        self.table.heartbeat("a", 0.0)
+        self.table.set_status("b", "failed", 0.0)
+        self.assertEqual([job["job"] for job in self.table.query(FINISHED, 0.0, 10)], ["b"])
+        self.assertEqual(len(self.table.query(None, 0.0, 10)), 2)
+        self.assertEqual(len(self.table.query(None, 0.0, 1)), 1)
+
+
+class TestBadRequests(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.app = make_app(timeout=1.0)
+        self.client = TestClient(TestServer(self.app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def put(self, path, data):
+        async with self.client.put(path, data=data) as response:
+            return response.status
+
+    async def test_malformed_bodies_get_400(self):
+        cases = [("/heartbeats", b"{not json"), ("/heartbeats", b'{"job": ["a"]}'),
+                 ("/heartbeats", b'{"jobs": [["a"]]}'), ("/status", b'{"job": "a"}'),
+                 ("/status", b'["a"]'), ("/statuses", b'{"job": "a", "status": "ok"}'),
+                 ("/statuses", b'[{"job": "a", "status": "ok"}, {"job": "b"}]'),
+                 ("/outputs", b'[{"job": "a", "stream": "stdout"}]'), ("/outputs", b"\xff")]
+        for path, data in cases:
+            with self.subTest(path=path, data=data):
+                self.assertEqual(await self.put(path, data), 400)
+        # The good first item of the bad batch was not applied either
+        self.assertEqual(self.app["table"].jobs, {})
+
+    async def test_good_bodies_still_accepted(self):
+        self.assertEqual(await self.put("/heartbeats", b'{"jobs": ["a", "b"]}'), 200)
+        self.assertEqual(await self.put("/status", b'{"status": "started"}'), 200)
+        self.assertEqual(set(self.app["table"].jobs), {"a", "b", "default"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,377 @@
+"""
+An asyncio tracking server for large fleets of agents, instead of the Flask
+dev server in dummy_tracking_server.py.
+
+- Runs on aiohttp.web, the library the agent already uses, so there is no
+  thread per request and no print() per heartbeat.
+- Job state lives in a dict of __slots__ Job objects keyed by job id.
+- A heartbeat only moves the job's deadline forward. Overdue jobs are found
+  by a timer wheel: every tick pops one bucket and the jobs in it are either
+  overdue (marked dead) or put back in the bucket of their new deadline. The
+  cost is O(jobs due) per tick, not O(all jobs), and O(1) per heartbeat.
+- Batched ingestion: PUT /heartbeats {"jobs": [...]} and
+  PUT /statuses [{"job": ..., "status": ...}, ...]. The single-job /status and
+  /heartbeat endpoints of the dummy server still work.
+- PUT /outputs [{"job": ..., "stream": "stdout", "data": ...}, ...] keeps the
+  last OUTPUT_TAIL characters of every job's output, GET /jobs/<id>/output.
+- GET /jobs?state=live|dead|finished lists jobs, GET /jobs/<id> shows one.
+- A body that is not JSON, or lacks a key or has one of the wrong type, gets
+  a 400 and changes nothing.
+- Dead and finished jobs are dropped `retention` seconds later (the same
+  timer wheel), so the table only grows with the live fleet.
+- Jobs are keyed by the "job" id the agent sends; the single-job agent sends
+  one too (--job-id, host-pid by default), requests without one all count
+  as the job "default".
+
+python tracking_server.py --port 5000 --timeout 5 --retention 600
+python tracking_server.py --benchmark --clients 50 --batch 100
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+LIVE = "live"
+DEAD = "dead"
+FINISHED = "finished"
+FINAL_STATUSES = ("completed", "failed")
+OUTPUT_TAIL = 16 * 1024
+
+
+class Job:
+    __slots__ = ("job_id", "status", "state", "last_beat", "deadline", "beats", "scheduled", "bucket",
+                 "output")
+
+    def __init__(self, job_id: str, now: float, timeout: float):
+        self.job_id = job_id
+        self.status = None
+        self.state = LIVE
+        self.last_beat = now
+        self.deadline = now + timeout
+        self.beats = 0
+        self.scheduled = False
+        self.bucket = None
+        self.output = None
+
+    def as_dict(self, now: float) -> dict:
+        return {"job": self.job_id, "status": self.status, "state": self.state,
+                "beats": self.beats, "seconds_since_beat": round(now - self.last_beat, 3)}
+
+
+class TimerWheel:
+    """Buckets of jobs by deadline tick; a bucket covers `tick` seconds."""
+
+    def __init__(self, tick: float = 0.1, size: int = 1024):
+        self.tick = tick
+        self.buckets = [set() for _ in range(size)]
+        self.current = None
+
+    def schedule(self, job: Job) -> None:
+        t = int(job.deadline / self.tick)
+        if self.current is None:
+            self.current = t - 1
+        elif t <= self.current:
+            t = self.current + 1
+        job.bucket = t % len(self.buckets)
+        self.buckets[job.bucket].add(job)
+        job.scheduled = True
+
+    def cancel(self, job: Job) -> None:
+        if job.scheduled:
+            self.buckets[job.bucket].discard(job)
+            job.scheduled = False
+
+    def advance(self, now: float) -> List[Job]:
+        """The jobs of every bucket up to now. Buckets wrap around, so a job
+        may come out before its deadline; callers check job.deadline."""
+        end = int(now / self.tick)
+        if self.current is None or end <= self.current:
+            return []
+        due = []
+        size = len(self.buckets)
+        for t in range(self.current + 1, min(end, self.current + size) + 1):
+            bucket = self.buckets[t % size]
+            if bucket:
+                self.buckets[t % size] = set()
+                due.extend(bucket)
+        self.current = end
+        return due
+
+
+class JobTable:
+    """Every job sits in the wheel: a live one until its heartbeat deadline,
+    a dead or finished one until `retention` seconds later, when it is
+    removed (retention=None keeps them forever)."""
+
+    def __init__(self, timeout: float = 5.0, tick: float = 0.1, retention: Optional[float] = 600.0):
+        self.timeout = timeout
+        self.retention = retention
+        self.jobs: Dict[str, Job] = {}
+        self.wheel = TimerWheel(tick)
+        self.heartbeats = 0
+        self.expired = 0
+        self.removed = 0
+
+    def _get(self, job_id: str, now: float) -> Job:
+        job = self.jobs.get(job_id)
+        if job is None:
+            job = self.jobs[job_id] = Job(job_id, now, self.timeout)
+            self.wheel.schedule(job)
+        return job
+
+    def _revive(self, job: Job, now: float) -> None:
+        job.state = LIVE
+        job.deadline = now + self.timeout
+        # Its bucket is the one of the later removal, move it
+        self.wheel.cancel(job)
+        self.wheel.schedule(job)
+
+    def _retire(self, job: Job, now: float) -> None:
+        self.wheel.cancel(job)
+        if self.retention is not None:
+            job.deadline = now + self.retention
+            self.wheel.schedule(job)
+
+    def heartbeat(self, job_id: str, now: float) -> None:
+        job = self.jobs.get(job_id)
+        if job is None:
+            job = self._get(job_id, now)
+        else:
+            job.last_beat = now
+            if job.state == LIVE:
+                # Only ever later, so the job can stay in its bucket
+                job.deadline = now + self.timeout
+            elif job.state == DEAD:
+                self._revive(job, now)
+        job.beats += 1
+        self.heartbeats += 1
+
+    def set_status(self, job_id: str, status: str, now: float) -> None:
+        job = self._get(job_id, now)
+        job.status = status
+        if status in FINAL_STATUSES:
+            if job.state != FINISHED:
+                job.state = FINISHED
+                self._retire(job, now)
+        else:
+            job.last_beat = now
+            if job.state == LIVE:
+                job.deadline = now + self.timeout
+            else:
+                self._revive(job, now)
+
+    def add_output(self, job_id: str, stream: str, data: str, now: float) -> None:
+        job = self._get(job_id, now)
+        if job.output is None:
+            job.output = {}
+        job.output[stream] = (job.output.get(stream, "") + data)[-OUTPUT_TAIL:]
+
+    def expire(self, now: float) -> int:
+        expired = 0
+        for job in self.wheel.advance(now):
+            job.scheduled = False
+            if job.deadline > now:
+                self.wheel.schedule(job)
+            elif job.state == LIVE:
+                job.state = DEAD
+                expired += 1
+                self._retire(job, now)
+            else:
+                del self.jobs[job.job_id]
+                self.removed += 1
+        self.expired += expired
+        return expired
+
+    def query(self, state: Optional[str], now: float, limit: int) -> List[dict]:
+        jobs = (job for job in self.jobs.values() if state is None or job.state == state)
+        return [job.as_dict(now) for job in itertools.islice(jobs, limit)]
+
+
+def make_app(timeout: float = 5.0, tick: float = 0.1, retention: Optional[float] = 600.0) -> web.Application:
+    table = JobTable(timeout, tick, retention)
+    app = web.Application()
+    app["table"] = table
+
+    def now():
+        return asyncio.get_running_loop().time()
+
+    async def parse(request, read):
+        # read(body) pulls everything out before the table is touched, so a bad
+        # item halfway through a batch doesn't leave half of it applied
+        raw = await request.read()
+        try:
+            return read(json.loads(raw) if raw else {})
+        except (ValueError, AttributeError, KeyError, TypeError) as error:
+            raise web.HTTPBadRequest(text=f"bad request body: {error!r}")
+
+    def text(item, name, default=None):
+        value = item.get(name, default)
+        if value is None:
+            raise KeyError(name)
+        if type(value) is not str:
+            raise TypeError(f"{name} must be a string")
+        return value
+
+    async def status(request):
+        job_id, state = await parse(request, lambda body: (text(body, "job", "default"), text(body, "status")))
+        table.set_status(job_id, state, now())
+        return web.Response()
+
+    async def statuses(request):
+        t = now()
+        items = await parse(request, lambda body: [(text(item, "job"), text(item, "status")) for item in body])
+        for job_id, state in items:
+            table.set_status(job_id, state, t)
+        return web.Response()
+
+    async def heartbeat(request):
+        # The single-job agent sends an empty PUT, with ?job=<id>
+        table.heartbeat(request.query.get("job", "default"), now())
+        return web.Response()
+
+    def job_ids(body):
+        ids = body["jobs"]
+        if type(ids) is not list or not all(type(job_id) is str for job_id in ids):
+            raise TypeError("jobs must be a list of strings")
+        return ids
+
+    async def heartbeats(request):
+        t = now()
+        beat = table.heartbeat
+        for job_id in await parse(request, job_ids):
+            beat(job_id, t)
+        return web.Response()
+
+    async def outputs(request):
+        t = now()
+        items = await parse(request, lambda body: [(text(item, "job"), text(item, "stream"), text(item, "data"))
+                                                   for item in body])
+        for job_id, stream, data in items:
+            table.add_output(job_id, stream, data, t)
+        return web.Response()
+
+    async def jobs(request):
+        state = request.query.get("state")
+        limit = int(request.query.get("limit", 1000))
+        return web.json_response({"heartbeats": table.heartbeats, "expired": table.expired,
+                                  "removed": table.removed, "jobs": table.query(state, now(), limit)})
+
+    async def job(request):
+        found = table.jobs.get(request.match_info["job_id"])
+        if found is None:
+            raise web.HTTPNotFound()
+        return web.json_response(found.as_dict(now()))
+
+    async def job_output(request):
+        found = table.jobs.get(request.match_info["job_id"])
+        if found is None:
+            raise web.HTTPNotFound()
+        return web.json_response(found.output or {})
+
+    async def expiry_loop():
+        while True:
+            await asyncio.sleep(tick)
+            table.expire(now())
+
+    async def start_expiry(app):
+        app["expiry"] = asyncio.create_task(expiry_loop())
+
+    async def stop_expiry(app):
+        app["expiry"].cancel()
+
+    app.router.add_put("/status", status)
+    app.router.add_put("/statuses", statuses)
+    app.router.add_put("/heartbeat", heartbeat)
+    app.router.add_put("/heartbeats", heartbeats)
+    app.router.add_get("/jobs", jobs)
+    app.router.add_put("/outputs", outputs)
+    app.router.add_get("/jobs/{job_id}", job)
+    app.router.add_get("/jobs/{job_id}/output", job_output)
+    app.on_startup.append(start_expiry)
+    app.on_cleanup.append(stop_expiry)
+    return app
+
+
+def serve(port: int, timeout: float, retention: Optional[float] = 600.0) -> None:
+    web.run_app(make_app(timeout, retention=retention), host="127.0.0.1", port=port,
+                access_log=None, print=None)
+
+
+async def load(url: str, clients: int, batch: int, duration: float):
+    """Each client sends PUT /heartbeats for its own `batch` jobs back to back."""
+    import aiohttp
+    import time
+
+    latencies = []
+    connector = aiohttp.TCPConnector(limit=clients)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        stop = time.perf_counter() + duration
+
+        async def client(n):
+            body = json.dumps({"jobs": [f"job-{n}-{i}" for i in range(batch)]})
+            headers = {"Content-Type": "application/json"}
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                async with session.put(f"{url}/heartbeats", data=body, headers=headers) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - start)
+
+        async def server_count():
+            async with session.get(f"{url}/jobs", params={"limit": "0"}) as response:
+                return (await response.json())["heartbeats"]
+
+        before = await server_count()
+        start = time.perf_counter()
+        await asyncio.gather(*(client(n) for n in range(clients)))
+        elapsed = time.perf_counter() - start
+        counted = await server_count() - before
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)]
+    return len(latencies), len(latencies) * batch / elapsed, p99, counted
+
+
+def benchmark(clients: int, batch: int, duration: float, port: int = 5097) -> None:
+    import multiprocessing
+    import time
+    import urllib.request
+
+    server = multiprocessing.Process(target=serve, args=(port, 5.0), daemon=True)
+    server.start()
+    try:
+        url = f"http://127.0.0.1:{port}"
+        for _ in range(50):
+            try:
+                urllib.request.urlopen(f"{url}/jobs?limit=0")
+                break
+            except OSError:
+                time.sleep(0.1)
+        for size in sorted({1, batch}):
+            requests, rate, p99, counted = asyncio.run(load(url, clients, size, duration))
+            print(f"{clients} clients x {size:4} jobs/request: {rate:10.0f} heartbeats/s, "
+                  f"{requests / duration:7.0f} requests/s, p99 {p99 * 1000:6.1f} ms, "
+                  f"server counted {counted} of {requests * size} sent")
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--timeout", type=float, default=5.0,
+                        help="Seconds without a heartbeat before a job is dead")
+    parser.add_argument("--retention", type=float, default=600.0,
+                        help="Seconds a dead or finished job is kept (negative: forever)")
+    parser.add_argument("--benchmark", action="store_true", help="Run the load generator instead")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=100, help="Jobs per batched heartbeat")
+    parser.add_argument("--duration", type=float, default=3.0)
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.clients, args.batch, args.duration)
+    else:
+        serve(args.port, args.timeout, None if args.retention < 0 else args.retention)
@@ -0,0 +1,176 @@
+# Per-host politeness for AsyncCrawler:
+#   TokenBucket            rate limiter, `rate` requests/sec with bursts of `burst`
+#   HostLimiter            per-host concurrency cap + per-host token bucket
+#   HostInterleavingQueue  asyncio.Queue that hands out items round-robin over
+#                          hosts, preferring hosts that still have free slots,
+#                          so a slow host can't take every worker
+#
+# A crawl touches a long tail of hosts once or twice, so neither keeps state
+# for idle hosts: HostLimiter forgets a host once nothing is in flight for it
+# and its bucket has refilled, and the queue only holds hosts with items.
+# HostLimiter.listeners tells the queue when a host at its cap gets a free
+# slot again, so get() never has to look at hosts that are still at the cap.
+
+import asyncio
+import heapq
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = None
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if self.updated is not None:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def full_at(self):
+        """Loop time at which the bucket is back at `burst` tokens."""
+        if self.updated is None:
+            return 0
+        return self.updated + (self.burst - self.tokens) / self.rate
+
+
+class HostLimiter:
+
+    def __init__(self, per_host_limit=None, per_host_rate=None, burst=1):
+        self.per_host_limit = per_host_limit
+        self.per_host_rate = per_host_rate
+        self.burst = burst
+        self.in_flight = Counter()    # requests holding or waiting for a slot
+        self.listeners = set()        # called with a host that was at its cap and has a free slot
+        self._semaphores = {}
+        self._buckets = {}
+        self._refilling = []          # heap of (bucket full_at, host) for idle hosts
+
+    def is_ready(self, host):
+        return self.per_host_limit is None or self.in_flight[host] < self.per_host_limit
+
+    @asynccontextmanager
+    async def slot(self, host):
+        if self._refilling:
+            self._forget_refilled(asyncio.get_running_loop().time())
+        self.in_flight[host] += 1
+        try:
+            if self.per_host_limit is None:
+                await self._wait_for_token(host)
+                yield
+            else:
+                if host not in self._semaphores:
+                    self._semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+                async with self._semaphores[host]:
+                    await self._wait_for_token(host)
+                    yield
+        finally:
+            left = self.in_flight[host] - 1
+            if left:
+                self.in_flight[host] = left
+            else:
+                self._forget(host)
+            if self.per_host_limit is not None and left == self.per_host_limit - 1:
+                for listener in list(self.listeners):
+                    listener(host)
+
+    def _forget(self, host):
+        # Nothing holds or waits for the semaphore any more, but the bucket has
+        # to refill first: a fresh one would hand the host a new burst early
+        del self.in_flight[host]
+        self._semaphores.pop(host, None)
+        bucket = self._buckets.get(host)
+        if bucket is not None:
+            full_at = bucket.full_at()
+            if full_at <= asyncio.get_running_loop().time():
+                del self._buckets[host]
+            else:
+                heapq.heappush(self._refilling, (full_at, host))
+
+    def _forget_refilled(self, now):
+        refilling = self._refilling
+        while refilling and refilling[0][0] <= now:
+            _, host = heapq.heappop(refilling)
+            bucket = self._buckets.get(host)
+            # Busy again, or refilling from a later request: pushed again when idle
+            if host not in self.in_flight and bucket is not None and bucket.full_at() <= now:
+                del self._buckets[host]
+
+    async def _wait_for_token(self, host):
+        if self.per_host_rate is None:
+            return
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.per_host_rate, self.burst)
+        await self._buckets[host].acquire()
+
+
+class HostInterleavingQueue(asyncio.Queue):
+    # Same _init/_put/_get hooks asyncio.PriorityQueue / LifoQueue override, so
+    # put/get/join/task_done and maxsize all keep working.
+
+    # With is_ready, call host_ready(host) when a host at its cap gets a free
+    # slot (add it to HostLimiter.listeners): get() sets hosts found at their
+    # cap aside until then, so it does not look at them on every call.
+
+    def __init__(self, maxsize=0, host_of=None, is_ready=None):
+        self._host_of = host_of
+        self._is_ready = is_ready
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self._hosts = OrderedDict()    # host -> deque of items, in rotation order
+        self._blocked = OrderedDict()  # the same for hosts found at their cap
+        self._size = 0
+
+    def qsize(self):
+        return self._size
+
+    def empty(self):
+        return self._size == 0
+
+    def host_ready(self, host):
+        items = self._blocked.pop(host, None)
+        if items is not None:
+            self._hosts[host] = items
+
+    def _put(self, item):
+        host = self._host_of(item)
+        items = self._hosts.get(host)
+        if items is None:
+            items = self._blocked.get(host)
+        if items is None:
+            items = self._hosts[host] = deque()
+        items.append(item)
+        self._size += 1
+
+    def _get(self):
+        hosts = self._hosts
+        if self._is_ready is not None:
+            # Each host is set aside at most once per time it reaches its cap
+            while hosts:
+                host = next(iter(hosts))
+                if self._is_ready(host):
+                    break
+                self._blocked[host] = hosts.pop(host)
+        if not hosts:
+            # Every host with items is at its cap: take the one set aside first
+            hosts = self._blocked
+        picked = next(iter(hosts))
+        items = hosts[picked]
+        item = items.popleft()
+        if items:
+            hosts.move_to_end(picked)
+        else:
+            del hosts[picked]
+        self._size -= 1
+        return item
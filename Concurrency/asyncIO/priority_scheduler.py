@@ -0,0 +1,275 @@
+# A priority- and deadline-aware replacement for "create_task everything and
+# gather", with a concurrency cap.
+#
+#   scheduler = PriorityScheduler(max_concurrency=10, group_weights={'crawl': 1, 'index': 3})
+#   future = scheduler.submit(send_status(...), priority=0, deadline=2.0, group='status')
+#   scheduler.submit(fetch(url), priority=5, group='crawl')
+#   await scheduler.join()
+#
+# - Lower priority numbers run first: queued urgent work overtakes queued bulk
+#   work as soon as a slot frees up (running tasks are not preempted).
+# - Inside one priority, groups share the slots by weighted round robin, so
+#   one group submitting 10000 tasks can't starve another submitting 10.
+# - deadline (seconds from submit): a timer armed at submit takes work still
+#   queued at its deadline out of the queue, or cancels it if it is running;
+#   its future gets DeadlineExceeded.
+# - submit() returns a future with the coroutine's result. Cancelling that
+#   future drops the job, or cancels it if it already runs.
+# - stats() gives per priority the completed count, the jobs that expired at
+#   their deadline, the jobs the caller cancelled, and latency percentiles
+#   (submit -> done).
+
+import asyncio
+import time
+from collections import OrderedDict, defaultdict, deque
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ('coro', 'priority', 'group', 'deadline', 'future', 'submitted', 'task', 'timer', 'queued')
+
+    def __init__(self, coro, priority, group, deadline, future, submitted):
+        self.coro = coro
+        self.priority = priority
+        self.group = group
+        self.deadline = deadline
+        self.future = future
+        self.submitted = submitted
+        self.task = None
+        self.timer = None
+        self.queued = True
+
+
+class _PriorityClass:
+    # Queued jobs of one priority: a deque per group, served round robin,
+    # `weight` jobs of a group per turn.
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.groups = OrderedDict()
+        self.credit = 0
+        self.size = 0
+
+    def push(self, job):
+        self.groups.setdefault(job.group, deque()).append(job)
+        self.size += 1
+
+    def pop(self):
+        group, queue = next(iter(self.groups.items()))
+        if self.credit <= 0:
+            self.credit = self.weights.get(group, 1)
+        job = queue.popleft()
+        self.size -= 1
+        self.credit -= 1
+        if not queue:
+            del self.groups[group]
+            self.credit = 0
+        elif self.credit <= 0:
+            self.groups.move_to_end(group)
+        return job
+
+    def remove(self, job):
+        # Expiring jobs are mostly near the front of their group's deque
+        queue = self.groups[job.group]
+        queue.remove(job)
+        self.size -= 1
+        if not queue:
+            if next(iter(self.groups)) == job.group:
+                self.credit = 0
+            del self.groups[job.group]
+
+
+class PriorityScheduler:
+
+    def __init__(self, max_concurrency=10, group_weights=None, keep_latencies=10000):
+        self.max_concurrency = max_concurrency
+        self.group_weights = group_weights or {}
+        self.running = 0
+        self._classes = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.latencies = defaultdict(lambda: deque(maxlen=keep_latencies))
+        self.completed = defaultdict(int)
+        self.expired = defaultdict(int)
+        self.cancelled = defaultdict(int)
+
+    @property
+    def queued(self):
+        return sum(c.size for c in self._classes.values())
+
+    def submit(self, coro, priority=0, deadline=None, group='default'):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        job = _Job(coro, priority, group, None if deadline is None else now + deadline,
+                   loop.create_future(), now)
+        if priority not in self._classes:
+            self._classes[priority] = _PriorityClass(self.group_weights)
+        self._classes[priority].push(job)
+        self._idle.clear()
+        if job.deadline is not None:
+            job.timer = loop.call_at(job.deadline, self._expire, job)
+        job.future.add_done_callback(lambda future, job=job: self._future_done(job))
+        self._dispatch()
+        return job.future
+
+    def _next_job(self):
+        for priority in sorted(self._classes):
+            if self._classes[priority].size:
+                return self._classes[priority].pop()
+        return None
+
+    def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self.running < self.max_concurrency:
+            job = self._next_job()
+            if job is None:
+                break
+            job.queued = False
+            if job.deadline is not None and loop.time() >= job.deadline:
+                self._drop(job, DeadlineExceeded('expired in queue'))
+                continue
+            self.running += 1
+            job.task = loop.create_task(job.coro)
+            job.task.add_done_callback(lambda task, job=job: self._finished(job))
+        if not self.running and not self.queued:
+            self._idle.set()
+
+    def _unqueue(self, job, error):
+        # Take a job out of the queue before its turn; error None cancels its future
+        self._classes[job.priority].remove(job)
+        job.queued = False
+        self._drop(job, error)
+        if not self.running and not self.queued:
+            self._idle.set()
+
+    def _expire(self, job):
+        if job.queued:
+            self._unqueue(job, DeadlineExceeded('expired in queue'))
+        elif job.task is not None:
+            job.task.cancel()
+
+    def _future_done(self, job):
+        if not job.future.cancelled():
+            return
+        if job.queued:
+            self._unqueue(job, None)
+        elif job.task is not None:
+            job.task.cancel()
+
+    def _drop(self, job, error):
+        if job.timer is not None:
+            job.timer.cancel()
+        job.coro.close()
+        if error is None:
+            self.cancelled[job.priority] += 1
+        else:
+            self.expired[job.priority] += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def _finished(self, job):
+        self.running -= 1
+        if job.timer is not None:
+            job.timer.cancel()
+        task, future = job.task, job.future
+        if task.cancelled():
+            if job.deadline is not None and task.get_loop().time() >= job.deadline:
+                self.expired[job.priority] += 1
+                if not future.done():
+                    future.set_exception(DeadlineExceeded('cancelled at deadline'))
+            else:
+                self.cancelled[job.priority] += 1
+                if not future.done():
+                    future.cancel()
+        else:
+            self.completed[job.priority] += 1
+            self.latencies[job.priority].append(task.get_loop().time() - job.submitted)
+            if not future.done():
+                if task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+        self._dispatch()
+
+    async def join(self):
+        """Wait until nothing is queued or running; any number of callers may wait."""
+        await self._idle.wait()
+
+    def stats(self):
+        result = {}
+        for priority in sorted(set(self.completed) | set(self.expired) | set(self.cancelled)):
+            latencies = sorted(self.latencies[priority])
+
+            def percentile(p):
+                return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] if latencies else None
+            result[priority] = {'completed': self.completed[priority], 'expired': self.expired[priority],
+                                'cancelled': self.cancelled[priority],
+                                'p50': percentile(50), 'p99': percentile(99)}
+        return result
+
+
+if __name__ == '__main__':
+    import random
+
+    STATUS, BULK = 0, 5
+
+    async def work(seconds):
+        await asyncio.sleep(seconds)
+
+    async def load(submit, duration=3.0):
+        # Saturated mix: bulk crawl fetches (50 ms) arrive at ~400/s for a cap
+        # of 10 slots (capacity 200/s); status updates (5 ms) at ~20/s.
+        loop = asyncio.get_running_loop()
+        end = loop.time() + duration
+        while loop.time() < end:
+            for _ in range(4):
+                submit(work(0.05), BULK, 'crawl-{}'.format(random.randint(0, 1)))
+            if random.random() < 0.2:
+                submit(work(0.005), STATUS, 'status')
+            await asyncio.sleep(0.01)
+
+    async def unscheduled():
+        # The examples' pattern: create_task for everything, a semaphore as cap
+        semaphore = asyncio.Semaphore(10)
+        latencies = defaultdict(list)
+        tasks = []
+
+        async def run(coro, priority, submitted):
+            async with semaphore:
+                await coro
+            latencies[priority].append(time.perf_counter() - submitted)
+
+        def submit(coro, priority, group):
+            tasks.append(asyncio.create_task(run(coro, priority, time.perf_counter())))
+
+        await load(submit)
+        await asyncio.gather(*tasks)
+        for priority, name in ((STATUS, 'status'), (BULK, 'crawl')):
+            values = sorted(latencies[priority])
+            print('  {:>6}: {:5} done, p99 {:8.1f} ms'.format(
+                name, len(values), values[int(len(values) * 0.99)] * 1000 if values else float('nan')))
+
+    async def scheduled():
+        scheduler = PriorityScheduler(max_concurrency=10)
+
+        def submit(coro, priority, group):
+            # Bulk work not started within 2 s is not worth doing any more
+            future = scheduler.submit(coro, priority, deadline=None if priority == STATUS else 2.0, group=group)
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        await load(submit)
+        await scheduler.join()
+        for priority, stats in scheduler.stats().items():
+            print('  {:>6}: {:5} done, p99 {:8.1f} ms, {} expired at their deadline'.format(
+                'status' if priority == STATUS else 'crawl', stats['completed'], stats['p99'] * 1000,
+                stats['expired']))
+
+    random.seed(1)
+    print('create_task + Semaphore(10):')
+    asyncio.run(unscheduled())
+    random.seed(1)
+    print('PriorityScheduler(10):')
+    asyncio.run(scheduled())
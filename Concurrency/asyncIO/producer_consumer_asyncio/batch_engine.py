@@ -0,0 +1,248 @@
+# A reusable, batched version of producer_consumer.py
+#
+# BatchQueue  - bounded queue of items stored as chunks; put_many() / get_batch()
+#               move a whole list per call, so the per-item cost is a list copy
+#               rather than a Queue.put/Queue.get round trip. Every chunk keeps
+#               the perf_counter() time it was enqueued, which gives exact
+#               per-item latency at per-chunk cost.
+# BatchEngine - consumers pulling batches from a BatchQueue into an async
+#               handler, scaled between min/max consumers by queue depth.
+
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from collections import deque
+
+
+class BatchQueue:
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._chunks = deque()    # (enqueued_at, items)
+        self._size = 0
+        self._getters = deque()
+        self._putters = deque()
+
+    def qsize(self):
+        return self._size
+
+    def empty(self):
+        return self._size == 0
+
+    def full(self):
+        return self._size >= self.maxsize
+
+    async def _wait(self, waiters):
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        try:
+            await future
+        except BaseException:
+            # Pass the wake-up on if we were woken and cancelled at the same time
+            future.cancel()
+            if future in waiters:
+                waiters.remove(future)
+            elif waiters is self._getters and self._size:
+                self._wake_one(waiters)
+            elif waiters is self._putters and not self.full():
+                self._wake_one(waiters)
+            raise
+
+    @staticmethod
+    def _wake_one(waiters):
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                break
+
+    async def put(self, item):
+        await self.put_many([item])
+
+    async def put_many(self, items):
+        """Put a list of items, waiting for room; never goes over maxsize.
+
+        A list that fits is queued as is, not copied, so don't reuse it.
+        """
+        start = 0
+        while start < len(items):
+            while self.full():
+                await self._wait(self._putters)
+            room = self.maxsize - self._size
+            chunk = items[start:start + room] if start or len(items) > room else items
+            self._chunks.append((time.perf_counter(), chunk))
+            self._size += len(chunk)
+            start += len(chunk)
+            self._wake_one(self._getters)
+        if not self.full():
+            self._wake_one(self._putters)
+
+    async def get_batch(self, max_items=1000, max_wait=0.0):
+        """Return (items, [(enqueued_at, count), ...]) with 1..max_items items.
+
+        Waits for the first item, then up to max_wait seconds more for the
+        batch to fill up.
+        """
+        while True:
+            while not self._size:
+                await self._wait(self._getters)
+            if max_wait and self._size < max_items:
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + max_wait
+                while self._size < max_items:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(self._wait(self._getters), remaining)
+                    except asyncio.TimeoutError:
+                        break
+            # Another getter may have taken everything while we waited
+            if self._size:
+                break
+
+        items, stamps = [], []
+        while self._chunks and len(items) < max_items:
+            enqueued_at, chunk = self._chunks[0]
+            wanted = max_items - len(items)
+            if len(chunk) <= wanted:
+                self._chunks.popleft()
+                items.extend(chunk)
+                stamps.append((enqueued_at, len(chunk)))
+            else:
+                items.extend(chunk[:wanted])
+                self._chunks[0] = (enqueued_at, chunk[wanted:])
+                stamps.append((enqueued_at, wanted))
+        self._size -= len(items)
+        self._wake_one(self._putters)
+        if self._size:
+            self._wake_one(self._getters)
+        return items, stamps
+
+
+class LatencyStats:
+    # Weighted histogram over fixed exponential buckets (1us .. ~17s)
+    BUCKETS = tuple(1e-6 * 2 ** i for i in range(25))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value, count=1):
+        self.counts[bisect_left(self.BUCKETS, value)] += count
+        self.count += count
+        self.total += value * count
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class BatchEngine:
+
+    def __init__(self, handler, maxsize=100000, batch_size=1000, max_wait=0.001,
+                 min_consumers=1, max_consumers=8, scale_interval=0.05,
+                 high_water=0.5, low_water=0.05):
+        self.handler = handler          # async def handler(items)
+        self.queue = BatchQueue(maxsize)
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.min_consumers = min_consumers
+        self.max_consumers = max_consumers
+        self.scale_interval = scale_interval
+        self.high_water = high_water
+        self.low_water = low_water
+        self.latency = LatencyStats()
+        self.processed = 0
+        self.peak_consumers = 0
+        self._consumers = set()
+        self._idle = set()
+        self._unfinished = 0
+        self._finished = asyncio.Event()
+        self._finished.set()
+        self._scaler = None
+
+    async def start(self):
+        for _ in range(self.min_consumers):
+            self._add_consumer()
+        self._scaler = asyncio.create_task(self._scale())
+
+    async def put(self, item):
+        await self.put_many([item])
+
+    async def put_many(self, items):
+        self._unfinished += len(items)
+        self._finished.clear()
+        await self.queue.put_many(items)
+
+    async def join(self):
+        await self._finished.wait()
+
+    async def stop(self):
+        await self.join()
+        tasks = list(self._consumers) + [self._scaler]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @property
+    def consumers(self):
+        return len(self._consumers)
+
+    def _add_consumer(self):
+        task = asyncio.create_task(self._consume())
+        self._consumers.add(task)
+        task.add_done_callback(self._consumers.discard)
+        self.peak_consumers = max(self.peak_consumers, len(self._consumers))
+
+    async def _consume(self):
+        task = asyncio.current_task()
+        try:
+            while True:
+                self._idle.add(task)
+                items, stamps = await self.queue.get_batch(self.batch_size, self.max_wait)
+                self._idle.discard(task)
+                try:
+                    await self.handler(items)
+                except Exception:
+                    logging.exception('Batch handler failed for %d items', len(items))
+                finally:
+                    now = time.perf_counter()
+                    for enqueued_at, count in stamps:
+                        self.latency.observe(now - enqueued_at, count)
+                    self.processed += len(items)
+                    self._unfinished -= len(items)
+                    if not self._unfinished:
+                        self._finished.set()
+        finally:
+            self._idle.discard(task)
+
+    async def _scale(self):
+        while True:
+            await asyncio.sleep(self.scale_interval)
+            depth = self.queue.qsize() / self.queue.maxsize
+            if depth > self.high_water and len(self._consumers) < self.max_consumers:
+                self._add_consumer()
+            elif depth < self.low_water and len(self._consumers) > self.min_consumers and self._idle:
+                # Only idle consumers are retired, they hold no items
+                self._idle.pop().cancel()
@@ -0,0 +1,86 @@
+# Benchmark harness for batch_engine.py
+# Producers generate items as fast as they can (no randsleep), consumers do a
+# little work per batch. Compares the one put/get per item asyncio.Queue
+# pipeline of producer_consumer.py with BatchEngine.
+#
+# python batch_engine_benchmark.py --items 2000000 --nprod 4
+
+import argparse
+import asyncio
+import time
+
+from batch_engine import BatchEngine
+
+CHUNK = 1000
+
+
+async def queue_pipeline(total, nprod, ncon, maxsize):
+    queue = asyncio.Queue(maxsize)
+    done = 0
+
+    async def produce(n):
+        for i in range(n):
+            await queue.put((i, time.perf_counter()))
+
+    async def consume():
+        nonlocal done
+        while True:
+            i, t = await queue.get()
+            done += i & 1
+            queue.task_done()
+
+    consumers = [asyncio.create_task(consume()) for _ in range(ncon)]
+    await asyncio.gather(*(produce(total // nprod) for _ in range(nprod)))
+    await queue.join()
+    for c in consumers:
+        c.cancel()
+
+
+async def engine_pipeline(total, nprod, ncon, maxsize, handler_delay):
+    async def handler(items):
+        sum(items)
+        if handler_delay:
+            await asyncio.sleep(handler_delay)
+
+    engine = BatchEngine(handler, maxsize=maxsize, batch_size=CHUNK, max_consumers=ncon)
+    await engine.start()
+    peak_depth = 0
+
+    async def produce(n):
+        nonlocal peak_depth
+        for start in range(0, n, CHUNK):
+            await engine.put_many(list(range(start, min(n, start + CHUNK))))
+            peak_depth = max(peak_depth, engine.queue.qsize())
+
+    await asyncio.gather(*(produce(total // nprod) for _ in range(nprod)))
+    await engine.stop()
+    return engine, peak_depth
+
+
+async def main(items, nprod, ncon, maxsize, handler_delay):
+    start = time.perf_counter()
+    await queue_pipeline(min(items, 200000), nprod, ncon, maxsize)
+    rate = min(items, 200000) / (time.perf_counter() - start)
+    print(f"asyncio.Queue, 1 item per put/get: {rate:12,.0f} items/sec")
+
+    start = time.perf_counter()
+    engine, peak_depth = await engine_pipeline(items, nprod, ncon, maxsize, handler_delay)
+    rate = engine.processed / (time.perf_counter() - start)
+    latency = engine.latency.summary()
+    print(f"BatchEngine, {CHUNK} items per batch:  {rate:12,.0f} items/sec")
+    print(f"  peak queue depth {peak_depth} (maxsize {maxsize}), "
+          f"peak consumers {engine.peak_consumers}")
+    print(f"  latency p50 {latency['p50'] * 1e3:0.3f} ms, p99 {latency['p99'] * 1e3:0.3f} ms, "
+          f"max {latency['max'] * 1e3:0.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--items", type=int, default=2000000)
+    parser.add_argument("-p", "--nprod", type=int, default=4)
+    parser.add_argument("-c", "--ncon", type=int, default=8)
+    parser.add_argument("--maxsize", type=int, default=100000)
+    parser.add_argument("--handler-delay", type=float, default=0.0,
+                        help="simulated I/O per batch, makes the engine scale out consumers")
+    ns = parser.parse_args()
+    asyncio.run(main(ns.items, ns.nprod, ns.ncon, ns.maxsize, ns.handler_delay))
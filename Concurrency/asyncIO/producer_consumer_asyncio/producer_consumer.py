@@ -46,11 +46,23 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--nprod", type=int, default=2)
     parser.add_argument("-c", "--ncon", type=int, default=5)
+    # Sharded mode (sharded_pipeline.py): consumers run in worker processes
+    parser.add_argument("-w", "--nproc", type=int, default=1,
+                        help="worker processes, each running --ncon consumers")
+    parser.add_argument("--items", type=int, default=1000, help="items per producer in sharded mode")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--ordered", action="store_true",
+                        help="keep each producer's items in order (keyed sharding)")
     ns = parser.parse_args()
 
     print("type of ns", type(ns))
     print("ns value is ", ns)
     start = time.perf_counter()
-    asyncio.run(main(**ns.__dict__))
+    if ns.nproc > 1:
+        from sharded_pipeline import sharded_main
+        asyncio.run(sharded_main(ns.nprod, ns.ncon, ns.nproc, items=ns.items,
+                                 batch_size=ns.batch_size, ordered=ns.ordered))
+    else:
+        asyncio.run(main(ns.nprod, ns.ncon))
     elapsed = time.perf_counter() - start
     print(f"Program completed in {elapsed:0.5f} seconds.")
\ No newline at end of file
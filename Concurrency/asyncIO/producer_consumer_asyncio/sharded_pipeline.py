@@ -0,0 +1,136 @@
+# Multi-process variant of producer_consumer.py for CPU-heavy consumers.
+#
+# Producers run in the main event loop and collect items into one batch per
+# shard. Every full batch is pickled once and sent over a multiprocessing Pipe
+# to a worker process, which runs its own event loop with `ncon` consumers.
+# With an ordering key, every item with the same key goes to the same shard
+# and the same consumer there, so items sharing a key are processed in order.
+#
+# python producer_consumer.py --nprod 4 --ncon 2 --nproc 4
+
+import asyncio
+import hashlib
+import multiprocessing as mp
+import time
+import zlib
+
+
+def cpu_work(item, rounds=200):
+    # Stand-in for a CPU-heavy consumer
+    digest = item.encode()
+    for _ in range(rounds):
+        digest = hashlib.sha256(digest).digest()
+    return digest
+
+
+def shard_of(key, n):
+    # crc32 rather than hash(): str hashes differ between processes
+    return zlib.crc32(key.encode()) % n
+
+
+def consumer_of(key, nproc, ncon):
+    # The consumer inside a shard: crc32 % ncon would follow crc32 % nproc
+    # (with nproc == ncon every key of a shard lands on one consumer)
+    return zlib.crc32(key.encode()) // nproc % ncon
+
+
+async def _shard_main(conn, nproc, ncon, ordered, consume_fn, queue_size):
+    loop = asyncio.get_running_loop()
+    queues = [asyncio.Queue(queue_size) for _ in range(ncon if ordered else 1)]
+    stats = {'processed': 0, 'errors': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+
+    async def consume(q):
+        while True:
+            key, item, t = await q.get()
+            try:
+                consume_fn(item)
+            except Exception:
+                # Counted and reported, a dead consumer would hang q.join()
+                stats['errors'] += 1
+            else:
+                # time.monotonic() is system-wide on Linux, so it is comparable
+                # with the producer's timestamp taken in another process
+                latency = time.monotonic() - t
+                stats['processed'] += 1
+                stats['latency_total'] += latency
+                stats['latency_max'] = max(stats['latency_max'], latency)
+            finally:
+                q.task_done()
+            # consume_fn is synchronous, let the reader and other consumers run
+            await asyncio.sleep(0)
+
+    if ordered:
+        consumers = [asyncio.create_task(consume(q)) for q in queues]
+    else:
+        consumers = [asyncio.create_task(consume(queues[0])) for _ in range(ncon)]
+
+    while True:
+        batch = await loop.run_in_executor(None, conn.recv)
+        if batch is None:
+            break
+        for entry in batch:
+            q = queues[consumer_of(entry[0], nproc, ncon)] if ordered else queues[0]
+            await q.put(entry)
+
+    for q in queues:
+        await q.join()
+    for c in consumers:
+        c.cancel()
+    conn.send(stats)
+    conn.close()
+
+
+def shard_worker(conn, nproc, ncon, ordered, consume_fn, queue_size):
+    asyncio.run(_shard_main(conn, nproc, ncon, ordered, consume_fn, queue_size))
+
+
+async def sharded_main(nprod, ncon, nproc, items=1000, batch_size=500, ordered=False,
+                       consume_fn=cpu_work, queue_size=1000):
+    from producer_consumer import makeitem
+
+    conns, procs = [], []
+    for _ in range(nproc):
+        parent_conn, child_conn = mp.Pipe()
+        proc = mp.Process(target=shard_worker, args=(child_conn, nproc, ncon, ordered, consume_fn, queue_size))
+        proc.start()
+        child_conn.close()
+        conns.append(parent_conn)
+        procs.append(proc)
+
+    batches = [[] for _ in range(nproc)]
+    # One lock per pipe, so batches from different producers don't interleave
+    send_locks = [asyncio.Lock() for _ in range(nproc)]
+
+    async def flush(shard):
+        batch, batches[shard] = batches[shard], []
+        async with send_locks[shard]:
+            # Blocks while the pipe is full, which is our backpressure
+            await asyncio.to_thread(conns[shard].send, batch)
+
+    async def produce(name):
+        for n in range(items):
+            item = await makeitem()
+            key = f"producer-{name}" if ordered else item
+            shard = shard_of(key, nproc) if ordered else (name + n) % nproc
+            batches[shard].append((key, item, time.monotonic()))
+            if len(batches[shard]) >= batch_size:
+                await flush(shard)
+
+    await asyncio.gather(*(produce(i) for i in range(nprod)))
+
+    stats = []
+    for shard, conn in enumerate(conns):
+        if batches[shard]:
+            await flush(shard)
+        conn.send(None)
+    for conn in conns:
+        stats.append(await asyncio.to_thread(conn.recv))
+    for proc in procs:
+        proc.join()
+
+    processed = sum(s['processed'] for s in stats)
+    errors = sum(s['errors'] for s in stats)
+    mean = sum(s['latency_total'] for s in stats) / processed if processed else 0.0
+    print(f"{processed} items over {nproc} processes, {errors} failed, "
+          f"latency mean {mean:0.5f} s, max {max(s['latency_max'] for s in stats):0.5f} s")
+    return stats
@@ -0,0 +1,39 @@
+import asyncio
+import unittest
+
+from priority_scheduler import DeadlineExceeded, PriorityScheduler
+
+
+class TestPriorityScheduler(unittest.TestCase):
+
+    def test_concurrent_joins_all_return(self):
+        async def main():
+            scheduler = PriorityScheduler(max_concurrency=2)
+            for _ in range(5):
+                scheduler.submit(asyncio.sleep(0.01))
+            await asyncio.wait_for(asyncio.gather(scheduler.join(), scheduler.join()), 1.0)
+            self.assertEqual(scheduler.completed[0], 5)
+            # Idle again: a later join returns at once, a new submit makes it wait
+            await asyncio.wait_for(scheduler.join(), 0.1)
+            scheduler.submit(asyncio.sleep(0.01))
+            await asyncio.wait_for(asyncio.gather(scheduler.join(), scheduler.join()), 1.0)
+            self.assertEqual(scheduler.completed[0], 6)
+        asyncio.run(main())
+
+    def test_expired_and_cancelled_are_counted_apart(self):
+        async def main():
+            scheduler = PriorityScheduler(max_concurrency=1)
+            scheduler.submit(asyncio.sleep(0.05))
+            late = scheduler.submit(asyncio.sleep(0.05), deadline=0.01)
+            unwanted = scheduler.submit(asyncio.sleep(0.05))
+            unwanted.cancel()
+            await scheduler.join()
+            with self.assertRaises(DeadlineExceeded):
+                late.result()
+            stats = scheduler.stats()[0]
+            self.assertEqual((stats['completed'], stats['expired'], stats['cancelled']), (1, 1, 1))
+        asyncio.run(main())
+
+
+if __name__ == '__main__':
+    unittest.main()
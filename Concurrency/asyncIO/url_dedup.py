@@ -0,0 +1,219 @@
+# Pluggable seen-url stores for AsyncCrawler.
+# All of them support `url in seen`, seen.add(url), len(seen) and nbytes()
+# so they can replace the plain set in AsyncCrawler.seen_urls.
+#
+#   SetSeenUrls         exact, keeps every url string (the original behaviour)
+#   ScalableBloomFilter probabilistic, may report an unseen url as seen with
+#                       a configurable false-positive rate, never the opposite
+#   HashedUrlStore      64-bit url fingerprints in an open-addressing table,
+#                       optionally mmap-backed so the table lives in a file
+
+import hashlib
+import math
+import mmap
+import os
+import sys
+
+
+def url_fingerprint(url):
+    digest = hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest()
+    # 0 marks an empty slot in HashedUrlStore
+    return int.from_bytes(digest, 'little') or 1
+
+
+class SetSeenUrls(set):
+
+    def nbytes(self):
+        return sys.getsizeof(self) + sum(sys.getsizeof(url) for url in self)
+
+
+class _BloomFilter:
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, h1, h2):
+        # Kirsch-Mitzenmacher double hashing: k positions from two hashes
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def contains(self, h1, h2):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(h1, h2))
+
+    def add(self, h1, h2):
+        bits = self.bits
+        for pos in self._positions(h1, h2):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+
+class ScalableBloomFilter:
+    # Almeida et al. "Scalable Bloom Filters": when a filter is full a new one is
+    # added with `growth` times the capacity and a tighter error rate, so the
+    # total false-positive rate stays under error_rate however many urls come in.
+
+    def __init__(self, initial_capacity=100000, error_rate=0.001, growth=2, tightening=0.5):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = []
+        self._add_filter()
+
+    def _add_filter(self):
+        n = len(self.filters)
+        capacity = self.initial_capacity * self.growth ** n
+        error_rate = self.error_rate * (1 - self.tightening) * self.tightening ** n
+        self.filters.append(_BloomFilter(capacity, error_rate))
+
+    @staticmethod
+    def _hashes(url):
+        digest = hashlib.blake2b(url.encode('utf-8'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def __contains__(self, url):
+        h1, h2 = self._hashes(url)
+        return any(f.contains(h1, h2) for f in reversed(self.filters))
+
+    def add(self, url):
+        h1, h2 = self._hashes(url)
+        if any(f.contains(h1, h2) for f in reversed(self.filters)):
+            return
+        if self.filters[-1].count >= self.filters[-1].capacity:
+            self._add_filter()
+        self.filters[-1].add(h1, h2)
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    def nbytes(self):
+        return sum(len(f.bits) for f in self.filters)
+
+
+class HashedUrlStore:
+    # Linear probing table of 8-byte fingerprints, ~8 / max_load bytes per url.
+    # Two different urls collide with probability ~n / 2**64, which is ~1e-9
+    # at tens of millions of urls.
+    # With a path that already holds a table (from an earlier crawl), that
+    # table is reopened, its size gives the capacity; otherwise it is created.
+
+    def __init__(self, initial_capacity=1 << 16, max_load=0.7, path=None):
+        self.max_load = max_load
+        self.path = path
+        self.count = 0
+        if path is not None and os.path.exists(path) and os.path.getsize(path):
+            self._open_table()
+        else:
+            self._make_table(self._round_capacity(initial_capacity))
+
+    @staticmethod
+    def _round_capacity(capacity):
+        return 1 << max(4, (capacity - 1).bit_length())
+
+    def _make_table(self, capacity):
+        nbytes = capacity * 8
+        if self.path is None:
+            buf = bytearray(nbytes)
+        else:
+            with open(self.path, 'w+b') as f:
+                f.truncate(nbytes)
+                buf = mmap.mmap(f.fileno(), nbytes)
+        self._use(buf, capacity)
+
+    def _open_table(self):
+        nbytes = os.path.getsize(self.path)
+        capacity = nbytes // 8
+        if nbytes % 8 or capacity < 16 or capacity & (capacity - 1):
+            raise ValueError('{} is not a HashedUrlStore table: {} bytes is not a power of two '
+                             'number of 8-byte slots'.format(self.path, nbytes))
+        with open(self.path, 'r+b') as f:
+            buf = mmap.mmap(f.fileno(), nbytes)
+        self._use(buf, capacity)
+        self.count = capacity - self.table.tolist().count(0)
+        if self.count > capacity * self.max_load:
+            self._grow()
+
+    def _use(self, buf, capacity):
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self._buf = buf
+        self.table = memoryview(buf).cast('Q')
+
+    def _slot(self, fp):
+        table, mask = self.table, self.mask
+        i = fp & mask
+        while True:
+            value = table[i]
+            if value == 0 or value == fp:
+                return i
+            i = (i + 1) & mask
+
+    def __contains__(self, url):
+        fp = url_fingerprint(url)
+        return self.table[self._slot(fp)] == fp
+
+    def add(self, url):
+        fp = url_fingerprint(url)
+        i = self._slot(fp)
+        if self.table[i] == fp:
+            return
+        self.table[i] = fp
+        self.count += 1
+        if self.count > self.capacity * self.max_load:
+            self._grow()
+
+    def _grow(self):
+        old_table, old_buf = self.table, self._buf
+        # Read the old fingerprints before an mmap-backed file is truncated
+        fingerprints = [fp for fp in old_table if fp]
+        old_table.release()
+        if isinstance(old_buf, mmap.mmap):
+            old_buf.close()
+        self._make_table(self.capacity * 2)
+        table = self.table
+        for fp in fingerprints:
+            table[self._slot(fp)] = fp
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        return self.capacity * 8
+
+
+def make_seen_urls(backend='set', **kwargs):
+    backends = {
+        'set': SetSeenUrls,
+        'bloom': ScalableBloomFilter,
+        'hashed': HashedUrlStore,
+    }
+    if backend not in backends:
+        raise ValueError('Unknown seen-url backend {!r}, use one of {}'.format(backend, sorted(backends)))
+    return backends[backend](**kwargs)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-urls', type=int, default=1000000)
+    ns = parser.parse_args()
+
+    urls = ['https://www.example.com/section/{}/article-{}.html'.format(i % 97, i)
+            for i in range(ns.num_urls)]
+    unseen = ['https://www.example.com/other/{}'.format(i) for i in range(100000)]
+    for backend in ('set', 'bloom', 'hashed'):
+        seen = make_seen_urls(backend)
+        start = time.perf_counter()
+        for url in urls:
+            seen.add(url)
+        elapsed = time.perf_counter() - start
+        false_positives = sum(url in seen for url in unseen)
+        print('{:>6}: {:6.1f} bytes/url, {:8.0f} adds/sec, false positives {:.5f}'.format(
+            backend, seen.nbytes() / len(seen), len(urls) / elapsed, false_positives / len(unseen)))
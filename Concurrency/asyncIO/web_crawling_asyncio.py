@@ -1,54 +1,280 @@
 import asyncio
+import hashlib
 import logging
+import os
+import sys
+import time
 import aiohttp
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from urllib.parse import urljoin, urlparse
-from lxml import html as lh
+from lxml import etree, html as lh
+
+from CoroutineAndConcurrency.tracing import tracer
+from crawl_state import NOT_MODIFIED
+from crawler_metrics import CrawlerMetrics
+from host_politeness import HostInterleavingQueue, HostLimiter
+from url_dedup import make_seen_urls
+
+
+def site_root(url):
+    return '{}://{}'.format(urlparse(url).scheme, urlparse(url).netloc)
+
+
+def extract_urls(html, base_url, allowed_prefixes=None):
+    # Module level so it can be pickled and run inside a worker process.
+    # Only the page bytes go to the worker and only the matching links come back.
+    allowed_prefixes = allowed_prefixes or base_url
+    found_urls = []
+    dom = lh.fromstring(html)
+    for href in dom.xpath('//a/@href'):
+        url = urljoin(base_url, href)
+        if url.startswith(allowed_prefixes):
+            found_urls.append(url)
+    return found_urls
+
+
+# What a page turns into when stream_links=True: the body itself is never kept
+StreamedPage = namedtuple('StreamedPage', 'links size content_hash')
+
+
+class StreamingLinkExtractor:
+    # Incremental extract_urls: feed() the body chunk by chunk as it arrives.
+    # Elements are cleared once parsed, so memory stays at about one chunk.
+
+    def __init__(self, base_url, allowed_prefixes=None):
+        self.base_url = base_url
+        self.allowed_prefixes = allowed_prefixes or base_url
+        self.parser = etree.HTMLPullParser(events=('start', 'end'))
+        self.links = []
+
+    def feed(self, chunk):
+        self.parser.feed(chunk)
+        self._read_events()
+
+    def close(self):
+        self.parser.close()
+        self._read_events()
+        return self.links
+
+    def _read_events(self):
+        for event, elem in self.parser.read_events():
+            if event == 'start':
+                if elem.tag == 'a':
+                    href = elem.get('href')
+                    if href is not None:
+                        url = urljoin(self.base_url, href)
+                        if url.startswith(self.allowed_prefixes):
+                            self.links.append(url)
+            else:
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+
+def make_parser_executor(parser_workers=None):
+    # lxml parsing is CPU-bound: on a free-threaded build (GIL disabled) threads
+    # can run it in parallel and skip pickling, otherwise we need processes.
+    parser_workers = parser_workers or os.cpu_count()
+    gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+    if gil_enabled:
+        return ProcessPoolExecutor(max_workers=parser_workers)
+    return ThreadPoolExecutor(max_workers=parser_workers)
 
 
 class AsyncCrawler:
 
-    def __init__(self, start_url, crawl_depth, max_concurrency=200, parser=None):
-        self.start_url = start_url
-        self.base_url = '{}://{}'.format(urlparse(self.start_url).scheme, urlparse(self.start_url).netloc)
+    def __init__(self, start_url, crawl_depth, max_concurrency=200, parser=None,
+                 parser_executor=None, parser_workers=None, seen_urls='set',
+                 per_host_limit=None, per_host_rate=None, keepalive_timeout=30, dns_cache_ttl=300,
+                 state_store=None, allowed_content_types=('text/html', 'application/xhtml+xml'),
+                 max_body_size=10 * 1024 * 1024, stream_links=False, chunk_size=64 * 1024,
+                 metrics=None, concurrency_limiter=None):
+        # start_url may also be a list of urls on several hosts
+        self.start_urls = [start_url] if isinstance(start_url, str) else list(start_url)
+        self.start_url = self.start_urls[0]
+        self.base_url = site_root(self.start_url)
+        self.base_urls = tuple(site_root(url) for url in self.start_urls)
         self.crawl_depth = crawl_depth
-        self.seen_urls = set()
-        self.session = aiohttp.ClientSession()
+        # 'set', 'bloom', 'hashed' (see url_dedup.py) or any object with add/in
+        self.seen_urls = make_seen_urls(seen_urls) if isinstance(seen_urls, str) else seen_urls
+        # One pool of keep-alive connections sized to the crawl, with cached DNS
+        # lookups, so requests to the same host reuse resolved, open sockets.
+        connector = aiohttp.TCPConnector(limit=max_concurrency, limit_per_host=per_host_limit or 0,
+                                         keepalive_timeout=keepalive_timeout,
+                                         use_dns_cache=True, ttl_dns_cache=dns_cache_ttl)
+        # Always on, see crawler_metrics.py for what is recorded
+        self.metrics = metrics if metrics is not None else CrawlerMetrics()
+        self.session = aiohttp.ClientSession(connector=connector, trace_configs=[self.metrics.trace_config()])
+        self.host_limiter = HostLimiter(per_host_limit, per_host_rate)
         self.parser = parser
-        self.bounde_sempahore = asyncio.BoundedSemaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        # An adaptive_limiter.AdaptiveLimiter moves the global limit with the
+        # observed latency and errors instead of the fixed max_concurrency
+        self.concurrency_limiter = concurrency_limiter
+        self.bounde_sempahore = concurrency_limiter or asyncio.BoundedSemaphore(max_concurrency)
+        # parser_executor: None parses on the event loop, True picks a pool with
+        # parser_workers workers, or pass any concurrent.futures.Executor.
+        self._own_executor = parser_executor is True
+        if self._own_executor:
+            parser_executor = make_parser_executor(parser_workers)
+        self.parser_executor = parser_executor
+        # A crawl_state.CrawlStateStore makes re-crawls conditional and lets
+        # crawl_stream() resume an interrupted run
+        self.state_store = state_store
+        # Responses with another Content-Type (a missing one is allowed) or a
+        # body over max_body_size are skipped before (or while) reading them.
+        # stream_links=True parses links out of the body chunk by chunk and
+        # yields StreamedPage instead of bytes.
+        self.allowed_content_types = allowed_content_types
+        self.max_body_size = max_body_size
+        self.stream_links = stream_links
+        self.chunk_size = chunk_size
+
+    def find_urls(self, html, page_url=None):
+        found_urls = extract_urls(html, page_url or self.base_url, self.base_urls)
+        return [url for url in found_urls if url not in self.seen_urls]
+
+    async def _extract_urls_async(self, html, page_url):
+        if self.parser_executor is None:
+            return extract_urls(html, page_url or self.base_url, self.base_urls)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.parser_executor, extract_urls, html,
+                                          page_url or self.base_url, self.base_urls)
+
+    async def find_urls_async(self, html, page_url=None, depth=None):
+        if html is NOT_MODIFIED:
+            # Unchanged page: reuse the links stored by the last crawl
+            found_urls = self.state_store.links(page_url)
+        elif isinstance(html, StreamedPage):
+            found_urls = html.links
+            if self.state_store is not None:
+                self.state_store.record_links(page_url, depth, found_urls)
+        else:
+            started = time.perf_counter()
+            found_urls = await self._extract_urls_async(html, page_url)
+            self.metrics.observe('parse', time.perf_counter() - started)
+            if self.state_store is not None:
+                self.state_store.record_links(page_url, depth, found_urls)
+        return [url for url in found_urls if url not in self.seen_urls]
 
-    def find_urls(self, html):
-        found_urls = []
-        dom = lh.fromstring(html)
-        for href in dom.xpath('//a/@href'):
-            url = urljoin(self.base_url, href)
-            if url not in self.seen_urls and url.startswith(self.base_url):
-                found_urls.append(url)
-        return found_urls
+    async def close(self):
+        await self.session.close()
+        if self.state_store is not None:
+            await self.state_store.flush()
+        if self._own_executor:
+            self.parser_executor.shutdown(wait=False)
 
     async def _http_request(self, url):
-        print('Fetching: {}'.format(url))
-        async with self.bounde_sempahore:
+        if tracer.enabled:
+            tracer.emit('fetch', url)
+        metrics = self.metrics
+        waiting = time.perf_counter()
+        # Take the host slot first, so a request waiting on a busy or
+        # rate-limited host does not hold one of the global slots.
+        async with self.host_limiter.slot(urlparse(url).netloc), self.bounde_sempahore:
+            started = time.perf_counter()
+            metrics.observe('semaphore_wait', started - waiting)
+            metrics.requests += 1
+            metrics.in_flight += 1
             try:
-                async with self.session.get(url, timeout=30) as response:
-                    html = await response.read()
+                store = self.state_store
+                # Only a page whose links were recorded can be answered from the
+                # store; one last fetched at the depth limit is fetched in full
+                incremental = store is not None and store.has_links(url)
+                headers = store.conditional_headers(url) if incremental else None
+                async with self.session.get(url, timeout=30, headers=headers) as response:
+                    # Response headers are in: time to first byte, connect included
+                    first_byte = time.perf_counter()
+                    metrics.observe('ttfb', first_byte - started)
+                    if self.concurrency_limiter is not None and response.status in (429, 503):
+                        self.concurrency_limiter.failed()
+                    if response.status == 304:
+                        return NOT_MODIFIED
+                    if not self._wanted(url, response):
+                        return None
+                    if self.stream_links:
+                        html = await self._stream_links(url, response)
+                    else:
+                        html = await self._read_body(url, response)
+                    # With stream_links this includes the interleaved parsing
+                    metrics.observe('body_read', time.perf_counter() - first_byte)
+                    if html is None:
+                        return None
+                    if store is not None:
+                        content_hash = html.content_hash if self.stream_links else store.content_hash(html)
+                        unchanged = incremental and store.is_unchanged(url, content_hash)
+                        store.record_response(url, response.headers.get('ETag'),
+                                              response.headers.get('Last-Modified'), content_hash)
+                        if unchanged:
+                            return NOT_MODIFIED
                     return html
             except Exception as e:
+                metrics.error(e)
                 logging.warning('Exception: {}'.format(e))
+                if self.concurrency_limiter is not None:
+                    self.concurrency_limiter.failed()
+            finally:
+                metrics.in_flight -= 1
+
+    def _wanted(self, url, response):
+        # A response without a Content-Type is kept: plenty of servers leave it
+        # out on html pages, and what is not html just yields no links. The
+        # max_body_size cap still applies to it.
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if self.allowed_content_types and content_type and content_type not in self.allowed_content_types:
+            logging.info('Skipping {}: content type {!r}'.format(url, content_type))
+            return False
+        length = response.content_length
+        if self.max_body_size and length is not None and length > self.max_body_size:
+            logging.info('Skipping {}: {} bytes'.format(url, length))
+            return False
+        return True
+
+    def _too_big(self, url, size):
+        # Content-Length may be missing or wrong, so the cap is also checked while reading
+        if self.max_body_size and size > self.max_body_size:
+            logging.info('Skipping {}: body over {} bytes'.format(url, self.max_body_size))
+            return True
+        return False
+
+    async def _read_body(self, url, response):
+        chunks, size = [], 0
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            size += len(chunk)
+            self.metrics.bytes += len(chunk)
+            if self._too_big(url, size):
+                return None
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    async def _stream_links(self, url, response):
+        extractor = StreamingLinkExtractor(url, self.base_urls)
+        digest = hashlib.blake2b(digest_size=16)
+        size = 0
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            size += len(chunk)
+            self.metrics.bytes += len(chunk)
+            if self._too_big(url, size):
+                return None
+            digest.update(chunk)
+            extractor.feed(chunk)
+        return StreamedPage(extractor.close(), size, digest.hexdigest())
 
-    async def extract_async(self, url):
+    async def extract_async(self, url, depth=None):
         data = await self._http_request(url)
         found_urls = set()
         if data:
-            for url in self.find_urls(data):
+            for url in await self.find_urls_async(data, url, depth):
                 found_urls.add(url)
         return url, data, sorted(found_urls)
 
-    async def extract_multi_async(self, to_fetch):
+    async def extract_multi_async(self, to_fetch, depth=None):
         futures, results = [], []
         for url in to_fetch:
             if url in self.seen_urls: continue
             self.seen_urls.add(url)
-            futures.append(self.extract_async(url))
+            futures.append(self.extract_async(url, depth))
 
         for future in asyncio.as_completed(futures):
             try:
@@ -58,19 +284,113 @@ class AsyncCrawler:
         return results
 
     async def crawl_async(self):
-        to_fetch = [self.start_url]
+        to_fetch = list(self.start_urls)
         results = []
         for depth in range(self.crawl_depth + 1):
-            batch = await self.extract_multi_async(to_fetch)
+            batch = await self.extract_multi_async(to_fetch, depth)
             to_fetch = []
             for url, data, found_urls in batch:
-                if self.parser:
+                if self.parser and data is not NOT_MODIFIED:
                     data = self.parser(data)
                 results.append((depth, url, data))
                 to_fetch.extend(found_urls)
-        await self.session.close()
+        await self.close()
         return results
 
+    # Frontier mode: instead of waiting for a whole depth level, N workers pull
+    # (depth, url, enqueued_at) items from a bounded queue and push discovered
+    # links right away, so one slow page only holds up its own worker.
+    # Links that do not fit into the bounded frontier wait in an overflow deque
+    # (only url strings, never page bodies).
+    def _enqueue(self, frontier, overflow, depth, url):
+        item = (depth, url, time.perf_counter())
+        try:
+            frontier.put_nowait(item)
+        except asyncio.QueueFull:
+            overflow.append(item)
+
+    async def _frontier_worker(self, frontier, overflow, results):
+        while True:
+            depth, url, enqueued_at = await frontier.get()
+            self.metrics.observe('queue_wait', time.perf_counter() - enqueued_at)
+            try:
+                data = await self._http_request(url)
+                if data and depth < self.crawl_depth:
+                    for found_url in await self.find_urls_async(data, url, depth):
+                        if found_url in self.seen_urls: continue
+                        self.seen_urls.add(found_url)
+                        if self.state_store is not None:
+                            self.state_store.add_to_frontier(found_url, depth + 1)
+                        self._enqueue(frontier, overflow, depth + 1, found_url)
+                if self.parser and data is not NOT_MODIFIED:
+                    data = self.parser(data)
+                await results.put((depth, url, data))
+            except Exception as e:
+                logging.warning('Encountered exception: {}'.format(e))
+                if self.state_store is not None:
+                    self.state_store.mark_done(url)
+            finally:
+                # Refill before task_done() so frontier.join() can not finish
+                # while there are still urls waiting in the overflow.
+                while overflow and not frontier.full():
+                    frontier.put_nowait(overflow.popleft())
+                frontier.task_done()
+
+    async def crawl_stream(self, num_workers=None):
+        """Async generator yielding (depth, url, data) as soon as each page is done.
+
+        With a state_store, data is NOT_MODIFIED for pages unchanged since the
+        last crawl, and a run that was interrupted resumes from its saved frontier.
+        """
+        num_workers = num_workers or self.max_concurrency
+        # Hands out urls round-robin over hosts, skipping hosts at their cap
+        frontier = HostInterleavingQueue(num_workers * 2, host_of=lambda item: urlparse(item[1]).netloc,
+                                         is_ready=self.host_limiter.is_ready)
+        self.host_limiter.listeners.add(frontier.host_ready)
+        results = asyncio.Queue(maxsize=num_workers)
+        overflow = deque()
+        done = object()
+
+        queued, todo = self.state_store.saved_frontier() if self.state_store is not None else ([], [])
+        if todo:
+            for url in queued:
+                self.seen_urls.add(url)
+            for depth, url in todo:
+                self._enqueue(frontier, overflow, depth, url)
+        else:
+            for url in self.start_urls:
+                if url in self.seen_urls: continue
+                self.seen_urls.add(url)
+                if self.state_store is not None:
+                    self.state_store.add_to_frontier(url, 0)
+                self._enqueue(frontier, overflow, 0, url)
+        workers = [asyncio.create_task(self._frontier_worker(frontier, overflow, results))
+                   for _ in range(num_workers)]
+
+        async def finish():
+            await frontier.join()
+            await results.put(done)
+        watcher = asyncio.create_task(finish())
+
+        try:
+            while True:
+                item = await results.get()
+                if item is done:
+                    if self.state_store is not None:
+                        self.state_store.clear_frontier()
+                    break
+                # Marked done only once handed out, so pages fetched but not yet
+                # consumed when a run is interrupted are fetched again on resume
+                if self.state_store is not None:
+                    self.state_store.mark_done(item[1])
+                yield item
+        finally:
+            for task in workers + [watcher]:
+                task.cancel()
+            await asyncio.gather(*workers, watcher, return_exceptions=True)
+            self.host_limiter.listeners.discard(frontier.host_ready)
+            await self.close()
+
 
 if __name__ == '__main__':
     url = 'https://www.theguardian.com'
@@ -80,4 +400,11 @@ if __name__ == '__main__':
     loop.run_until_complete(future)
     loop.close()
     result = future.result()
-    print(len(result))
\ No newline at end of file
+    print(len(result))
+
+    # Same crawl in frontier mode, pages are handled while they stream in
+    # async def stream():
+    #     crawler = AsyncCrawler(url, 3)
+    #     async for depth, page_url, data in crawler.crawl_stream():
+    #         print(depth, page_url, len(data or b''))
+    # asyncio.run(stream())
\ No newline at end of file
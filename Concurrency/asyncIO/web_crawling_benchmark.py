@@ -0,0 +1,76 @@
+# Benchmark for AsyncCrawler parser executor mode.
+# Starts a local fixture HTTP server with link-heavy pages and crawls it with
+# link extraction on the event loop and then in a pool of 1, 2, 4 ... workers.
+#
+# python web_crawling_benchmark.py --pages 2000 --links 300
+# python web_crawling_benchmark.py --adaptive   (AdaptiveLimiter instead of the semaphore)
+
+import argparse
+import asyncio
+import os
+import time
+
+from aiohttp import web
+
+from adaptive_limiter import AdaptiveLimiter
+from web_crawling_asyncio import AsyncCrawler
+
+
+def make_app(pages, links):
+    async def page(request):
+        n = int(request.match_info.get('n', 0))
+        body = ''.join('<li><a href="/page/{}">page {}</a></li>'.format((n * links + i) % pages, i)
+                       for i in range(links))
+        return web.Response(text='<html><body><ul>{}</ul></body></html>'.format(body),
+                            content_type='text/html')
+
+    app = web.Application()
+    app.router.add_get('/', page)
+    app.router.add_get('/page/{n}', page)
+    return app
+
+
+async def crawl(url, depth, max_concurrency, parser_workers, adaptive=False):
+    limiter = AdaptiveLimiter(initial_limit=20, max_limit=max_concurrency) if adaptive else None
+    crawler = AsyncCrawler(url, depth, max_concurrency=max_concurrency,
+                           parser_executor=True if parser_workers else None,
+                           parser_workers=parser_workers, concurrency_limiter=limiter)
+    start = time.perf_counter()
+    pages = 0
+    async for _ in crawler.crawl_stream():
+        pages += 1
+    return pages, time.perf_counter() - start
+
+
+async def main(pages, links, depth, max_concurrency, port, adaptive=False):
+    runner = web.AppRunner(make_app(pages, links))
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    url = 'http://127.0.0.1:{}/'.format(port)
+
+    workers = [0]
+    n = 1
+    while n <= os.cpu_count():
+        workers.append(n)
+        n *= 2
+    try:
+        for parser_workers in workers:
+            fetched, elapsed = await crawl(url, depth, max_concurrency, parser_workers, adaptive)
+            label = 'event loop' if not parser_workers else '{} workers'.format(parser_workers)
+            print('{:>12}: {} pages in {:0.2f}s -> {:0.1f} pages/sec'.format(
+                label, fetched, elapsed, fetched / elapsed))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--links', type=int, default=300)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--max-concurrency', type=int, default=200)
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--adaptive', action='store_true',
+                        help='use an AdaptiveLimiter (up to --max-concurrency) instead of a fixed semaphore')
+    ns = parser.parse_args()
+    asyncio.run(main(ns.pages, ns.links, ns.depth, ns.max_concurrency, ns.port, ns.adaptive))